@@ -1,37 +1,33 @@
 import json
-import os
 import hashlib
-import secrets
-import psycopg2
-import psycopg2.extras
-from typing import Dict, Any
-from pydantic import BaseModel, Field
+from functools import lru_cache
+from typing import Dict, Any, Tuple
 from datetime import datetime
+from db import dict_cursor, get_db_connection, release_db_connection
+from sessions import SESSION_TTL_SECONDS, issue_token
+from timing import instrumented, span
 
-class LoginRequest(BaseModel):
-    username: str = Field(..., min_length=3, max_length=100)
-    password: str = Field(..., min_length=4)
-
-class RegisterRequest(BaseModel):
-    username: str = Field(..., min_length=3, max_length=100)
-    password: str = Field(..., min_length=4)
-
-def get_db_connection():
-    """Get database connection using environment variable"""
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        raise Exception("DATABASE_URL not configured")
-    return psycopg2.connect(database_url)
+@lru_cache(maxsize=None)
+def request_models() -> Tuple[type, type]:
+    """Login and registration models, pydantic is imported by the first request that validates"""
+    from pydantic import BaseModel, Field
+    
+    class LoginRequest(BaseModel):
+        username: str = Field(..., min_length=3, max_length=100)
+        password: str = Field(..., min_length=4)
+    
+    class RegisterRequest(BaseModel):
+        username: str = Field(..., min_length=3, max_length=100)
+        password: str = Field(..., min_length=4)
+    
+    return LoginRequest, RegisterRequest
 
 def hash_password(password: str) -> str:
     """Hash password with salt using SHA256"""
     salt = "alright_alright_alright"  # Simple salt for demo
     return hashlib.sha256(f"{password}{salt}".encode()).hexdigest()
 
-def generate_token() -> str:
-    """Generate a secure random token"""
-    return secrets.token_urlsafe(32)
-
+@instrumented('auth')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Business: Handle user authentication - login and registration
@@ -65,6 +61,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     try:
         body_data = json.loads(event.get('body', '{}'))
         action = body_data.get('action', 'login')
+        LoginRequest, RegisterRequest = request_models()
         
         if action == 'register':
             register_req = RegisterRequest(**body_data)
@@ -85,16 +82,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     # Hash the password
     password_hash = hash_password(password)
     
+    conn = None
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor = dict_cursor(conn)
         
         if action == 'register':
             # Check if user already exists
             cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
             if cursor.fetchone():
                 cursor.close()
-                conn.close()
                 return {
                     'statusCode': 409,
                     'headers': {'Access-Control-Allow-Origin': '*'},
@@ -111,11 +108,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             user_id = cursor.fetchone()['id']
             conn.commit()
             
-            # Generate token
-            token = generate_token()
+            # Signed session token, verified by chat and documents without a DB lookup
+            token = issue_token(user_id)
             
             cursor.close()
-            conn.close()
             
             return {
                 'statusCode': 201,
@@ -127,22 +123,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'user_id': user_id,
                     'username': username,
                     'token': token,
+                    'expires_in': SESSION_TTL_SECONDS,
                     'message': 'Registration successful'
                 })
             }
             
         else:  # Login
             # Check credentials
-            cursor.execute("""
-                SELECT id, username FROM users 
-                WHERE username = %s AND password_hash = %s
-            """, (username, password_hash))
-            
-            user = cursor.fetchone()
+            with span('fetch'):
+                cursor.execute("""
+                    SELECT id, username FROM users 
+                    WHERE username = %s AND password_hash = %s
+                """, (username, password_hash))
+                
+                user = cursor.fetchone()
             
             if not user:
                 cursor.close()
-                conn.close()
                 return {
                     'statusCode': 401,
                     'headers': {'Access-Control-Allow-Origin': '*'},
@@ -155,11 +152,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             """, (datetime.now(), user['id']))
             conn.commit()
             
-            # Generate token
-            token = generate_token()
+            # Signed session token, verified by chat and documents without a DB lookup
+            token = issue_token(user['id'])
             
             cursor.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -171,6 +167,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'user_id': user['id'],
                     'username': user['username'],
                     'token': token,
+                    'expires_in': SESSION_TTL_SECONDS,
                     'message': 'Login successful'
                 })
             }
@@ -183,4 +180,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'error': 'Database operation failed',
                 'detail': str(e)
             })
-        }
\ No newline at end of file
+        }
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
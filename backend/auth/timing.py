@@ -0,0 +1,101 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# DEBUG, INFO or ERROR. Debug lines sit behind "if DEBUG:" so their f-strings
+# are not even built on the hot path unless the level asks for them
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+DEBUG = LOG_LEVEL == 'DEBUG'
+INFO = LOG_LEVEL in ('DEBUG', 'INFO')
+
+class RequestTimer:
+    """Milliseconds spent per named stage of one request, repeated stages add up"""
+
+    def __init__(self, function: str):
+        self.function = function
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, milliseconds: float) -> None:
+        with self._lock:
+            self.spans[name] = self.spans.get(name, 0.0) + milliseconds
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - started) * 1000)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, browsers show it in the network panel"""
+        with self._lock:
+            parts = [f"{name};dur={milliseconds:.1f}" for name, milliseconds in self.spans.items()]
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ', '.join(parts)
+
+    def log(self, method: str, status: int) -> None:
+        """One structured line per request"""
+        if not INFO:
+            return
+        with self._lock:
+            spans = {name: round(milliseconds, 1) for name, milliseconds in self.spans.items()}
+        print(f"[INFO] request {json.dumps({'function': self.function, 'method': method, 'status': status, 'total_ms': round(self.elapsed_ms(), 1), 'spans': spans})}")
+
+_current: ContextVar[Optional[RequestTimer]] = ContextVar('request_timer', default=None)
+
+def current_timer() -> Optional[RequestTimer]:
+    return _current.get()
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a stage of the current request, a no-op outside of one (e.g. in the worker)"""
+    timer = _current.get()
+    if timer is None:
+        yield
+    else:
+        with timer.span(name):
+            yield
+
+def log_after(timer: RequestTimer, body: Iterator[str], method: str, status: int) -> Iterator[str]:
+    """Streamed bodies are logged once their last frame is out"""
+    _current.set(timer)
+    try:
+        yield from body
+    finally:
+        _current.set(None)
+        timer.log(method, status)
+
+def instrumented(function: str) -> Callable:
+    """Handler decorator: collects spans, sets the Server-Timing header and logs the request"""
+    def decorate(handler: Callable) -> Callable:
+        @wraps(handler)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            timer = RequestTimer(function)
+            token = _current.set(timer)
+            try:
+                response = handler(event, context)
+            finally:
+                _current.reset(token)
+
+            method = event.get('httpMethod', 'GET')
+            headers = response.setdefault('headers', {})
+            headers['Server-Timing'] = timer.server_timing()
+            headers['Timing-Allow-Origin'] = '*'
+            if isinstance(response.get('body'), str):
+                timer.log(method, response['statusCode'])
+            else:
+                response['body'] = log_after(timer, response['body'], method, response['statusCode'])
+            return response
+        return wrapper
+    return decorate
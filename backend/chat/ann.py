@@ -0,0 +1,204 @@
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import numpy as np
+import psycopg2.extras
+from vectors import EMBEDDING_DTYPE, stack_embeddings, top_k
+
+# Libraries smaller than this are scanned exactly, larger ones get an IVF index
+ANN_MIN_CHUNKS = int(os.getenv('ANN_MIN_CHUNKS', '2000'))
+# Lists probed per query before the recall check raises it
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', '8'))
+# Build-time recall@k target against the exact scan
+ANN_TARGET_RECALL = float(os.getenv('ANN_TARGET_RECALL', '0.95'))
+ANN_RECALL_K = 8
+ANN_RECALL_QUERIES = 100
+
+# Index is retrained once the library grows past this multiple of its training size
+ANN_REBUILD_GROWTH = 2.0
+ANN_TRAINING_ITERATIONS = 10
+ANN_MAX_TRAINING_ROWS = 8192
+ANN_ASSIGN_BATCH = 2000
+
+def list_count(size: int) -> int:
+    """Number of inverted lists, about sqrt(n) keeps list scans and centroid scans balanced"""
+    return max(1, int(round(np.sqrt(size))))
+
+def train_centroids(sample: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """Spherical k-means over unit vectors, returns (nlist, dim) unit centroids"""
+    rng = np.random.default_rng(seed)
+    nlist = min(nlist, sample.shape[0])
+    centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+    
+    for _ in range(ANN_TRAINING_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        
+        # Empty lists are reseeded from random sample rows
+        empty = np.bincount(assignments, minlength=nlist) == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+        
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = (sums / np.maximum(norms, 1e-12)).astype(EMBEDDING_DTYPE)
+    return centroids
+
+def assign_lists(centroids: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    """Nearest centroid of every row"""
+    if matrix.shape[0] == 0:
+        return np.empty(0, dtype=np.int32)
+    return np.argmax(matrix @ centroids.T, axis=1).astype(np.int32)
+
+def probe_lists(centroids: np.ndarray, query: np.ndarray, nprobe: int) -> List[int]:
+    """Lists whose centroids are closest to the query"""
+    return [row for row, _ in top_k(centroids, query, nprobe)]
+
+def recall_at_k(matrix: np.ndarray, assignments: np.ndarray, centroids: np.ndarray, queries: np.ndarray, k: int, nprobe: int) -> float:
+    """Share of exact top-k rows that the IVF search also returns"""
+    found = 0
+    expected = 0
+    for query in queries:
+        exact = {row for row, _ in top_k(matrix, query, k)}
+        candidates = np.flatnonzero(np.isin(assignments, probe_lists(centroids, query, nprobe)))
+        approximate = {int(candidates[row]) for row, _ in top_k(matrix[candidates], query, k)}
+        found += len(exact & approximate)
+        expected += len(exact)
+    return found / expected if expected else 1.0
+
+def tune_nprobe(sample: np.ndarray, centroids: np.ndarray, seed: int = 0) -> Dict[str, float]:
+    """Smallest nprobe (doubling from ANN_NPROBE) that reaches the target recall on the sample"""
+    rng = np.random.default_rng(seed)
+    queries = sample[rng.choice(sample.shape[0], min(ANN_RECALL_QUERIES, sample.shape[0]), replace=False)]
+    # Perturbed rows stand in for queries, which rarely equal a stored chunk
+    queries = queries + rng.normal(0, 0.5 / np.sqrt(sample.shape[1]), queries.shape).astype(EMBEDDING_DTYPE)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    
+    assignments = assign_lists(centroids, sample)
+    nprobe = min(ANN_NPROBE, centroids.shape[0])
+    while True:
+        recall = recall_at_k(sample, assignments, centroids, queries, ANN_RECALL_K, nprobe)
+        if recall >= ANN_TARGET_RECALL or nprobe >= centroids.shape[0]:
+            return {'nprobe': nprobe, 'recall': recall}
+        nprobe = min(nprobe * 2, centroids.shape[0])
+
+def load_index(cursor, user_id: int) -> Optional[Dict[str, Any]]:
+    """Read user's IVF index, None when the library is scanned exactly"""
+    cursor.execute("""
+        SELECT dim, nlist, nprobe, centroids, trained_size, recall
+        FROM vector_indexes WHERE user_id = %s
+    """, (user_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    centroids = np.frombuffer(bytes(row['centroids']), dtype=EMBEDDING_DTYPE).reshape(row['nlist'], row['dim'])
+    return {
+        'dim': row['dim'],
+        'nprobe': row['nprobe'],
+        'centroids': centroids,
+        'trained_size': row['trained_size'],
+        'recall': row['recall']
+    }
+
+def assign_chunks(cursor, user_id: int, centroids: np.ndarray, only_unassigned: bool) -> int:
+    """Write ann_list for the user's embedded chunks in keyset batches, returns rows assigned"""
+    assigned = 0
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT id, embedding FROM document_chunks
+            WHERE user_id = %s AND embedding IS NOT NULL AND id > %s
+              AND (ann_list IS NULL OR NOT %s)
+            ORDER BY id
+            LIMIT %s
+        """, (user_id, last_id, only_unassigned, ANN_ASSIGN_BATCH))
+        rows = cursor.fetchall()
+        if not rows:
+            return assigned
+        last_id = rows[-1]['id']
+        
+        # Chunks of another dimension keep ann_list NULL and are scanned exactly
+        matrix, positions = stack_embeddings([row['embedding'] for row in rows], centroids.shape[1])
+        lists = assign_lists(centroids, matrix)
+        updates = [(rows[p]['id'], int(lists[row])) for row, p in enumerate(positions)]
+        if updates:
+            psycopg2.extras.execute_values(cursor, """
+                UPDATE document_chunks SET ann_list = v.ann_list
+                FROM (VALUES %s) AS v(id, ann_list)
+                WHERE document_chunks.id = v.id
+            """, updates, page_size=1000)
+        assigned += len(updates)
+
+def build_index(cursor, user_id: int, size: int) -> Dict[str, Any]:
+    """Train centroids on a sample of the library, tune nprobe and assign every chunk"""
+    nlist = list_count(size)
+    cursor.execute("""
+        SELECT embedding FROM document_chunks
+        WHERE user_id = %s AND embedding IS NOT NULL
+        ORDER BY random()
+        LIMIT %s
+    """, (user_id, min(ANN_MAX_TRAINING_ROWS, nlist * 64)))
+    blobs = [row['embedding'] for row in cursor.fetchall()]
+    
+    # Train on the most common dimension, the current embedding model
+    sizes = np.bincount([len(blob) for blob in blobs])
+    dim = int(np.argmax(sizes)) // EMBEDDING_DTYPE.itemsize
+    sample, _ = stack_embeddings(blobs, dim)
+    
+    centroids = train_centroids(sample, nlist)
+    tuning = tune_nprobe(sample, centroids)
+    
+    cursor.execute("""
+        INSERT INTO vector_indexes (user_id, dim, nlist, nprobe, centroids, trained_size, recall, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (user_id) DO UPDATE
+        SET dim = EXCLUDED.dim, nlist = EXCLUDED.nlist, nprobe = EXCLUDED.nprobe,
+            centroids = EXCLUDED.centroids, trained_size = EXCLUDED.trained_size,
+            recall = EXCLUDED.recall, updated_at = EXCLUDED.updated_at
+    """, (user_id, dim, centroids.shape[0], tuning['nprobe'], centroids.tobytes(), size, tuning['recall'], datetime.now()))
+    
+    cursor.execute("UPDATE document_chunks SET ann_list = NULL WHERE user_id = %s AND ann_list IS NOT NULL", (user_id,))
+    assign_chunks(cursor, user_id, centroids, only_unassigned=True)
+    
+    print(f"[INFO] Built ANN index for user {user_id}: {size} chunks, {centroids.shape[0]} lists, "
+          f"nprobe {tuning['nprobe']}, recall@{ANN_RECALL_K} {tuning['recall']:.3f}")
+    return {'nprobe': tuning['nprobe'], 'recall': tuning['recall']}
+
+def bump_library_version(cursor, user_id: int) -> None:
+    """Invalidate cached vector indexes of user's library in chat instances"""
+    cursor.execute("""
+        INSERT INTO library_versions (user_id, version, updated_at)
+        VALUES (%s, 1, %s)
+        ON CONFLICT (user_id) DO UPDATE
+        SET version = library_versions.version + 1, updated_at = EXCLUDED.updated_at
+    """, (user_id, datetime.now()))
+
+def maintain_index(cursor, user_id: int) -> str:
+    """
+    Keep user's IVF index in step with the library after uploads and deletes
+    Args: cursor - DictCursor inside the caller's transaction
+          user_id - owner of the library
+    Returns: action taken, one of none, built, assigned, dropped
+    """
+    cursor.execute("""
+        SELECT COUNT(*) AS count FROM document_chunks
+        WHERE user_id = %s AND embedding IS NOT NULL
+    """, (user_id,))
+    size = cursor.fetchone()['count']
+    index = load_index(cursor, user_id)
+    
+    if size < ANN_MIN_CHUNKS:
+        if index is None:
+            return 'none'
+        cursor.execute("DELETE FROM vector_indexes WHERE user_id = %s", (user_id,))
+        cursor.execute("UPDATE document_chunks SET ann_list = NULL WHERE user_id = %s AND ann_list IS NOT NULL", (user_id,))
+        return 'dropped'
+    
+    # Retraining doubles the size it covers, so its cost per added chunk stays constant
+    if index is None or size > index['trained_size'] * ANN_REBUILD_GROWTH:
+        build_index(cursor, user_id, size)
+        return 'built'
+    
+    # New chunks join their nearest list, deleted ones have already left theirs
+    assign_chunks(cursor, user_id, index['centroids'], only_unassigned=True)
+    return 'assigned'
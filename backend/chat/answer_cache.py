@@ -0,0 +1,59 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from embedding_cache import normalize_text
+
+# Opt-in, answers are reused only while the library version is unchanged
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'false').lower() == 'true'
+# Least recently used answers are evicted past the size, any answer past the TTL
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '512'))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600'))
+
+_answers: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+def answer_key(user_id: int, library_version: int, message: str, history: List[Dict[str, Any]]) -> str:
+    """Cache key from user, library version, normalized question and the prompt history"""
+    history_hash = hashlib.sha256(json.dumps(
+        [[msg.get('role', 'user'), msg.get('content', '')] for msg in history],
+        ensure_ascii=False
+    ).encode('utf-8')).hexdigest()
+    return hashlib.sha256(
+        f"{user_id}\n{library_version}\n{normalize_text(message)}\n{history_hash}".encode('utf-8')
+    ).hexdigest()
+
+def lookup_answer(key: str) -> Optional[Dict[str, Any]]:
+    """Stored answer for the key, None on a miss or when it expired"""
+    item = _answers.get(key)
+    if item is not None and item[0] <= time.monotonic():
+        del _answers[key]
+        _stats['expirations'] += 1
+        item = None
+    
+    if item is None:
+        _stats['misses'] += 1
+        return None
+    
+    _answers.move_to_end(key)
+    _stats['hits'] += 1
+    return item[1]
+
+def store_answer(key: str, answer: Dict[str, Any]) -> None:
+    """Keep answer for ANSWER_CACHE_TTL_SECONDS, evicting least recently used ones over the size"""
+    _answers[key] = (time.monotonic() + ANSWER_CACHE_TTL_SECONDS, answer)
+    _answers.move_to_end(key)
+    while len(_answers) > ANSWER_CACHE_SIZE:
+        _answers.popitem(last=False)
+        _stats['evictions'] += 1
+
+def answer_cache_stats() -> Dict[str, Any]:
+    """Hit rate and counters of this instance since it started"""
+    lookups = _stats['hits'] + _stats['misses']
+    return {
+        **_stats,
+        'entries': len(_answers),
+        'hit_rate': round(_stats['hits'] / lookups, 3) if lookups else 0.0
+    }
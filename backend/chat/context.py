@@ -0,0 +1,109 @@
+import math
+import os
+import re
+from typing import Dict, Any, List, Tuple
+
+# Prompt token budget for system prompt, excerpts, history and the question
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '6000'))
+# Share of the remaining budget reserved for conversation history
+HISTORY_TOKEN_SHARE = float(os.getenv('HISTORY_TOKEN_SHARE', '0.3'))
+MAX_HISTORY_MESSAGES = 10
+
+# Role markers and separators the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Truncated excerpts shorter than this are dropped instead
+MIN_EXCERPT_TOKENS = 50
+TRUNCATION_MARK = ' ...'
+
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+
+def count_tokens(text: str) -> int:
+    """
+    Estimate BPE token count locally without a tokenizer dependency
+    ASCII words average about 4 characters per token, other scripts
+    (Cyrillic, CJK) about 2, punctuation is one token each
+    """
+    tokens = 0
+    for piece in TOKEN_PATTERN.findall(text):
+        chars_per_token = 4 if piece.isascii() else 2
+        tokens += max(1, math.ceil(len(piece) / chars_per_token))
+    return tokens
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text at a word boundary so it fits in roughly max_tokens"""
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+
+    max_tokens -= count_tokens(TRUNCATION_MARK)
+    cut = int(len(text) * max_tokens / total)
+    while cut > 0 and count_tokens(text[:cut]) > max_tokens:
+        cut = int(cut * 0.9)
+    boundary = text.rfind(' ', 0, cut)
+    return text[:boundary if boundary > 0 else cut].rstrip() + TRUNCATION_MARK
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    """Tokens one chat message costs, including role overhead"""
+    return count_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+def assemble_context(
+    chunks: List[Dict[str, Any]],
+    history: List[Dict[str, Any]],
+    message: str,
+    system_template: str,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    history_share: float = HISTORY_TOKEN_SHARE
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Fit retrieved chunks and conversation history into the token budget
+    Args: chunks - retrieved excerpts with name, content, similarity and optional fused score
+          history - previous messages, oldest first
+          message - current user question
+          system_template - system prompt without the excerpts
+    Returns: kept chunks (best first), kept history (oldest first) and a report
+    """
+    history = history[-MAX_HISTORY_MESSAGES:]
+    fixed = count_tokens(system_template) + count_tokens(message) + 2 * MESSAGE_OVERHEAD_TOKENS
+    available = max(0, budget - fixed)
+
+    # History gets its share first, newest messages are kept over older ones
+    history_cap = int(available * history_share)
+    history_costs = [message_tokens(msg) for msg in history]
+    kept_from = len(history)
+    history_used = 0
+    while kept_from > 0 and history_used + history_costs[kept_from - 1] <= history_cap:
+        kept_from -= 1
+        history_used += history_costs[kept_from]
+
+    # Excerpts fill the rest, lowest ranked (fused score, else similarity) is trimmed first
+    remaining = available - history_used
+    kept_chunks = []
+    truncated = 0
+    for chunk in sorted(chunks, key=lambda item: item.get('score', item['similarity']), reverse=True):
+        cost = count_tokens(chunk['name']) + count_tokens(chunk['content']) + MESSAGE_OVERHEAD_TOKENS
+        if cost <= remaining:
+            kept_chunks.append(chunk)
+            remaining -= cost
+            continue
+
+        room = remaining - count_tokens(chunk['name']) - MESSAGE_OVERHEAD_TOKENS
+        if room >= MIN_EXCERPT_TOKENS:
+            content = truncate_to_tokens(chunk['content'], room)
+            kept_chunks.append({**chunk, 'content': content})
+            remaining -= count_tokens(chunk['name']) + count_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+            truncated += 1
+        break
+
+    # Budget left after excerpts goes back to older history
+    while kept_from > 0 and history_costs[kept_from - 1] <= remaining:
+        kept_from -= 1
+        remaining -= history_costs[kept_from]
+
+    report = {
+        'token_budget': budget,
+        'tokens_used': budget - remaining if available else fixed,
+        'chunks_dropped': len(chunks) - len(kept_chunks),
+        'chunks_truncated': truncated,
+        'history_dropped': kept_from
+    }
+    return kept_chunks, history[kept_from:], report
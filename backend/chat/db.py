@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, Optional
+from timing import span
+
+# psycopg2 is imported when the first connection is made, so requests
+# answered before touching the database do not pay for loading it
+if TYPE_CHECKING:
+    from psycopg2 import pool
+
+# Warm instances keep connections open between invocations, bounded per instance
+DB_POOL_MIN_CONNECTIONS = int(os.getenv('DB_POOL_MIN_CONNECTIONS', '1'))
+DB_POOL_MAX_CONNECTIONS = int(os.getenv('DB_POOL_MAX_CONNECTIONS', '4'))
+# Seconds to wait for a free connection when all of them are checked out
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))
+# Connections idle longer than this are pinged before reuse
+DB_HEALTH_CHECK_SECONDS = float(os.getenv('DB_HEALTH_CHECK_SECONDS', '30'))
+
+_pool: Optional['pool.ThreadedConnectionPool'] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(DB_POOL_MAX_CONNECTIONS)
+_last_used: Dict[int, float] = {}
+
+def get_pool() -> 'pool.ThreadedConnectionPool':
+    """Create the instance-wide pool on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from psycopg2 import pool
+                
+                database_url = os.getenv('DATABASE_URL')
+                if not database_url:
+                    raise Exception("DATABASE_URL not configured")
+                _pool = pool.ThreadedConnectionPool(DB_POOL_MIN_CONNECTIONS, DB_POOL_MAX_CONNECTIONS, database_url)
+    return _pool
+
+def is_healthy(conn) -> bool:
+    """Closed connections are dropped, long idle ones must answer a ping"""
+    import psycopg2
+    
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_HEALTH_CHECK_SECONDS:
+        return True
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error as e:
+        print(f"[INFO] Dropping stale database connection: {e}")
+        return False
+
+def get_db_connection():
+    """Borrow a pooled connection, every caller must hand it back with release_db_connection"""
+    with span('db-connect'):
+        if not _slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise Exception("Database connection pool exhausted")
+        try:
+            connections = get_pool()
+            conn = connections.getconn()
+            while not is_healthy(conn):
+                _last_used.pop(id(conn), None)
+                connections.putconn(conn, close=True)
+                conn = connections.getconn()
+            return conn
+        except Exception:
+            _slots.release()
+            raise
+
+def release_db_connection(conn) -> None:
+    """Return connection to the pool, rolling back anything left uncommitted"""
+    import psycopg2
+    import psycopg2.extensions
+    
+    close = bool(conn.closed)
+    if not close and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            close = True
+    
+    if close:
+        _last_used.pop(id(conn), None)
+    else:
+        _last_used[id(conn)] = time.monotonic()
+    try:
+        get_pool().putconn(conn, close=close)
+    finally:
+        _slots.release()
+
+@contextmanager
+def db_connection() -> Iterator:
+    """Pooled connection for the duration of a with block"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        release_db_connection(conn)
+
+def dict_cursor(conn):
+    """Cursor returning rows addressable by column name"""
+    import psycopg2.extras
+    
+    return conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import random
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Callable, Dict, Optional, Sequence
+
+# numpy comes in with vectors on the first lookup, answer_cache imports
+# normalize_text from here without paying for it
+if TYPE_CHECKING:
+    import numpy as np
+
+# First tier lives in the warm instance, second tier in the embedding_cache table
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '1024'))
+EMBEDDING_CACHE_TTL_HOURS = int(os.getenv('EMBEDDING_CACHE_TTL_HOURS', '168'))
+
+# Share of writes that also purge a batch of expired rows
+EVICTION_PROBABILITY = 0.05
+EVICTION_BATCH_SIZE = 500
+
+_memory_cache: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+_stats = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'errors': 0}
+
+def normalize_text(text: str) -> str:
+    """Normalize query so trivially different spellings share a cache entry"""
+    return ' '.join(unicodedata.normalize('NFKC', text).split()).casefold()
+
+def cache_key(model: str, text: str) -> str:
+    """Cache key from embedding model and normalized text"""
+    return hashlib.sha256(f"{model}\n{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+def remember(key: str, vector: 'np.ndarray') -> None:
+    """Put embedding into the in-process LRU tier"""
+    _memory_cache[key] = vector
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > EMBEDDING_CACHE_SIZE:
+        _memory_cache.popitem(last=False)
+
+def lookup_embedding(key: str, connect: Callable) -> Optional['np.ndarray']:
+    """Find embedding in memory, then in the database, None on a miss"""
+    vector = _memory_cache.get(key)
+    if vector is not None:
+        _memory_cache.move_to_end(key)
+        _stats['memory_hits'] += 1
+        return vector
+    
+    row = None
+    try:
+        with connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT embedding FROM embedding_cache
+                WHERE cache_key = %s AND expires_at > %s
+            """, (key, datetime.now()))
+            row = cursor.fetchone()
+            cursor.close()
+    except Exception as e:
+        _stats['errors'] += 1
+        print(f"[ERROR] Embedding cache lookup failed: {e}")
+    
+    if row is None:
+        _stats['misses'] += 1
+        return None
+    
+    from vectors import unpack_embedding
+    vector = unpack_embedding(bytes(row[0]))
+    remember(key, vector)
+    _stats['db_hits'] += 1
+    return vector
+
+def store_embedding(key: str, model: str, embedding: Sequence[float], connect: Callable) -> None:
+    """Save embedding in both tiers, failures only cost a future cache miss"""
+    from vectors import pack_embedding, unpack_embedding
+    
+    packed = pack_embedding(embedding)
+    remember(key, unpack_embedding(packed))
+    
+    try:
+        with connect() as conn:
+            cursor = conn.cursor()
+            now = datetime.now()
+            cursor.execute("""
+                INSERT INTO embedding_cache (cache_key, model, embedding, created_at, expires_at)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (cache_key) DO UPDATE
+                SET embedding = EXCLUDED.embedding, created_at = EXCLUDED.created_at, expires_at = EXCLUDED.expires_at
+            """, (key, model, packed, now, now + timedelta(hours=EMBEDDING_CACHE_TTL_HOURS)))
+            
+            if random.random() < EVICTION_PROBABILITY:
+                cursor.execute("""
+                    DELETE FROM embedding_cache
+                    WHERE cache_key IN (
+                        SELECT cache_key FROM embedding_cache
+                        WHERE expires_at <= %s
+                        LIMIT %s
+                    )
+                """, (now, EVICTION_BATCH_SIZE))
+            
+            conn.commit()
+            cursor.close()
+    except Exception as e:
+        _stats['errors'] += 1
+        print(f"[ERROR] Embedding cache write failed: {e}")
+
+def cache_stats() -> Dict[str, int]:
+    """Hit and miss counters of this instance since it started"""
+    return {**_stats, 'memory_entries': len(_memory_cache)}
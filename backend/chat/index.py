@@ -1,30 +1,81 @@
 import json
 import os
-import requests
-import psycopg2
-import psycopg2.extras
-from typing import Dict, Any, List, Optional
-from pydantic import BaseModel, Field
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextvars import copy_context
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Tuple
+from context import MAX_HISTORY_MESSAGES, assemble_context
+from answer_cache import ANSWER_CACHE_ENABLED, answer_cache_stats, answer_key, lookup_answer, store_answer
+from lexical import fuse_hits, has_identifier, lexical_search
+from db import db_connection, dict_cursor
+from upstream import openai_post
+from sessions import authenticate
+from timing import DEBUG, INFO, current_timer, instrumented, span
+from embedding_cache import cache_key, cache_stats, lookup_embedding, store_embedding
 
-class ChatMessage(BaseModel):
-    role: str = Field(..., pattern='^(user|assistant|system)$')
-    content: str = Field(..., min_length=1)
+EMBEDDING_MODEL = "text-embedding-3-small"
+CHAT_MODEL = "gpt-4o-mini"
+# Requested embedding size, must match the documents function; 0 keeps the model's 1536
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', '0'))
+# Cached query vectors are keyed by model and size, so the two never mix
+EMBEDDING_MODEL_ID = f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else EMBEDDING_MODEL
+# Candidates per requested hit scored on compact codes, then re-ranked on float32 vectors
+RERANK_FACTOR = int(os.getenv('RERANK_FACTOR', '4'))
 
-class ChatRequest(BaseModel):
-    message: str = Field(..., min_length=1)
-    conversation_history: List[ChatMessage] = Field(default_factory=list)
-    user_id: int = Field(..., gt=0)
+# Seconds each provider call may take, retries included
+EMBEDDING_DEADLINE = float(os.getenv('EMBEDDING_DEADLINE', '10'))
+COMPLETION_DEADLINE = float(os.getenv('COMPLETION_DEADLINE', '30'))
 
-def get_db_connection():
-    """Get database connection using environment variable"""
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        raise Exception("DATABASE_URL not configured")
-    return psycopg2.connect(database_url)
+# Queries of at most this many words with an identifier-like term, all found in one chunk,
+# skip the embedding call. Ordinary short questions still go through vector search
+LEXICAL_FAST_PATH = os.getenv('LEXICAL_FAST_PATH', 'true').lower() == 'true'
+LEXICAL_FAST_PATH_MAX_WORDS = int(os.getenv('LEXICAL_FAST_PATH_MAX_WORDS', '3'))
+# Seconds retrieval waits for the query embedding when text hits are already available
+EMBEDDING_FALLBACK_SECONDS = float(os.getenv('EMBEDDING_FALLBACK_SECONDS', '2'))
 
-def create_embedding(text: str) -> Optional[List[float]]:
-    """Create embedding for text query"""
-    print(f"[DEBUG] Creating embedding for text: '{text[:100]}...'")
+DOCUMENTS_PROMPT = """You are a helpful AI assistant with access to the user's personal knowledge base. 
+Use the following excerpts from documents in their library to answer questions:
+
+{doc_context}
+
+When answering:
+1. Base your response on the provided documents when relevant
+2. If information isn't in the documents, you can provide general knowledge but mention it's not from their documents
+3. Cite which documents you're referencing when using them
+4. Be helpful and accurate
+5. Respond in the same language as the user's question"""
+
+NO_DOCUMENTS_PROMPT = """You are a helpful AI assistant. The user has a document library, but no relevant documents were found for this query. 
+Answer based on your general knowledge and mention that no relevant documents were found in their library."""
+
+# Warm instances keep each user's compact chunk codes between requests,
+# bounded by their total size and evicted least recently used first
+VECTOR_CACHE_MAX_BYTES = int(os.getenv('VECTOR_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+_vector_cache: 'OrderedDict[int, Dict[str, Any]]' = OrderedDict()
+_vector_cache_bytes = 0
+
+# Query embedding runs here while the request thread fetches the library
+_retrieval_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='retrieval')
+
+def create_embedding(text: str) -> Optional[Sequence[float]]:
+    """Create embedding for text query, served from the embedding cache when possible"""
+    key = cache_key(EMBEDDING_MODEL_ID, text)
+    cached = lookup_embedding(key, db_connection)
+    if cached is not None:
+        if DEBUG:
+            print(f"[DEBUG] Embedding cache hit for text: '{text[:100]}...'")
+        return cached
+    
+    embedding = request_embedding(text)
+    if embedding is not None:
+        store_embedding(key, EMBEDDING_MODEL_ID, embedding, db_connection)
+    return embedding
+
+def request_embedding(text: str) -> Optional[List[float]]:
+    """Create embedding for text query using OpenAI API"""
+    if DEBUG:
+        print(f"[DEBUG] Creating embedding for text: '{text[:100]}...'")
     
     openai_api_key = os.getenv('OPENAI_API_KEY')
     if not openai_api_key:
@@ -32,37 +83,20 @@ def create_embedding(text: str) -> Optional[List[float]]:
         return None
     
     try:
-        headers = {
-            "Authorization": f"Bearer {openai_api_key}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
-            "model": "text-embedding-3-small",
+            "model": EMBEDDING_MODEL,
             "input": text[:8000]  # Limit text length
         }
+        if EMBEDDING_DIMENSIONS:
+            data["dimensions"] = EMBEDDING_DIMENSIONS
         
-        # Check if proxy is configured
-        proxy_url = os.getenv('PROXY_URL')
-        proxies = {}
-        if proxy_url:
-            proxies = {
-                'http': proxy_url,
-                'https': proxy_url
-            }
-            print("[DEBUG] Using proxy for OpenAI request")
-        
-        response = requests.post(
-            "https://api.openai.com/v1/embeddings",
-            headers=headers,
-            json=data,
-            timeout=10,
-            proxies=proxies
-        )
+        with span('embed'):
+            response = openai_post("/embeddings", data, deadline=EMBEDDING_DEADLINE)
         
         if response.status_code == 200:
             embedding = response.json()['data'][0]['embedding']
-            print(f"[DEBUG] Embedding created successfully, length: {len(embedding)}")
+            if DEBUG:
+                print(f"[DEBUG] Embedding created successfully, length: {len(embedding)}")
             return embedding
         else:
             print(f"[ERROR] OpenAI API error: {response.status_code}, {response.text}")
@@ -71,82 +105,377 @@ def create_embedding(text: str) -> Optional[List[float]]:
         print(f"[ERROR] Failed to create embedding: {e}")
         return None
 
-def search_documents(query: str, user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
-    """Search user documents using vector similarity"""
-    print(f"[DEBUG] Starting document search for query: '{query}', user: {user_id}")
+def get_library_version(cursor, user_id: int) -> int:
+    """Get user's library version, bumped by every document upload or delete"""
+    cursor.execute("SELECT version FROM library_versions WHERE user_id = %s", (user_id,))
+    row = cursor.fetchone()
+    return row['version'] if row else 0
+
+def get_cached_library(user_id: int, version: int) -> Optional[Dict[str, Any]]:
+    """Get cached vector index for user if it matches the library version"""
+    entry = _vector_cache.get(user_id)
+    if entry is None or entry['version'] != version:
+        return None
+    _vector_cache.move_to_end(user_id)
+    return entry
+
+def library_bytes(entry: Dict[str, Any]) -> int:
+    """Memory held by the centroids and loaded list codes of a cached index"""
+    from vectors import codes_bytes
     
-    query_embedding = create_embedding(query)
-    if not query_embedding:
-        print("[ERROR] Failed to create query embedding")
-        return []
+    total = sum(codes_bytes(segment['codes']) for segment in entry['segments'].values())
+    if entry['index'] is not None:
+        total += entry['index']['centroids'].nbytes
+    return total
+
+def cache_library(user_id: int, entry: Dict[str, Any]) -> None:
+    """Store user's vector index, evicting least recently used entries over budget"""
+    global _vector_cache_bytes
     
-    print(f"[DEBUG] Query embedding created, length: {len(query_embedding)}")
+    previous = _vector_cache.pop(user_id, None)
+    if previous is not None:
+        _vector_cache_bytes -= previous['bytes']
     
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        # Get all documents with embeddings for this user
+    entry['bytes'] = library_bytes(entry)
+    if entry['bytes'] > VECTOR_CACHE_MAX_BYTES:
+        return
+    
+    while _vector_cache and _vector_cache_bytes + entry['bytes'] > VECTOR_CACHE_MAX_BYTES:
+        _, evicted = _vector_cache.popitem(last=False)
+        _vector_cache_bytes -= evicted['bytes']
+    
+    _vector_cache[user_id] = entry
+    _vector_cache_bytes += entry['bytes']
+
+def fetch_segments(cursor, user_id: int, lists: Optional[List[int]]) -> Dict[Optional[int], Dict[str, Any]]:
+    """
+    Load ids, names and compact codes of chunks grouped by inverted list
+    lists=None loads the chunks no list covers (every chunk without an index)
+    Float32 vectors are only read for chunks without a code of the configured
+    kind (written before codes or under another EMBEDDING_CODE), which are encoded here
+    """
+    from vectors import CODE_HEADERS, EMBEDDING_CODE, EMBEDDING_DTYPE, encode_code, stack_codes, unpack_embedding
+    
+    header = CODE_HEADERS.get(EMBEDDING_CODE, 0)
+    if lists is None:
         cursor.execute("""
-            SELECT id, name, content, embedding
-            FROM documents 
-            WHERE embedding IS NOT NULL AND user_id = %s
-        """, (user_id,))
-        
-        documents = cursor.fetchall()
-        print(f"[DEBUG] Found {len(documents)} documents with embeddings for user {user_id}")
+            SELECT c.id, c.document_id, d.name, c.ann_list, octet_length(c.embedding) AS embedding_size,
+                   CASE WHEN get_byte(c.embedding_code, 0) = %s THEN c.embedding_code END AS embedding_code,
+                   CASE WHEN c.embedding_code IS NULL OR get_byte(c.embedding_code, 0) <> %s THEN c.embedding END AS embedding
+            FROM document_chunks c
+            JOIN documents d ON d.id = c.document_id
+            WHERE c.embedding IS NOT NULL AND c.user_id = %s AND c.ann_list IS NULL
+        """, (header, header, user_id))
+    else:
+        cursor.execute("""
+            SELECT c.id, c.document_id, d.name, c.ann_list, octet_length(c.embedding) AS embedding_size,
+                   CASE WHEN get_byte(c.embedding_code, 0) = %s THEN c.embedding_code END AS embedding_code,
+                   CASE WHEN c.embedding_code IS NULL OR get_byte(c.embedding_code, 0) <> %s THEN c.embedding END AS embedding
+            FROM document_chunks c
+            JOIN documents d ON d.id = c.document_id
+            WHERE c.embedding IS NOT NULL AND c.user_id = %s AND c.ann_list = ANY(%s)
+        """, (header, header, user_id, lists))
+    chunks = cursor.fetchall()
+    
+    grouped: Dict[Optional[int], List[Any]] = {key: [] for key in (lists or [None])}
+    for row in chunks:
+        grouped[row['ann_list']].append(row)
+    
+    segments = {}
+    for key, rows in grouped.items():
+        # The query vector is not known yet, so the codes take the most common stored dimension
+        sizes = Counter(row['embedding_size'] for row in rows)
+        dim = sizes.most_common(1)[0][0] // EMBEDDING_DTYPE.itemsize if sizes else 0
+        if header:
+            blobs = [row['embedding_code'] if row['embedding_code'] is not None else encode_code(unpack_embedding(row['embedding']), EMBEDDING_CODE)
+                     for row in rows]
+        else:
+            blobs = [row['embedding'] for row in rows]
+        codes, positions = stack_codes(blobs, EMBEDDING_CODE, dim)
+        segments[key] = {
+            'ids': [rows[p]['id'] for p in positions],
+            'document_ids': [rows[p]['document_id'] for p in positions],
+            'names': [rows[p]['name'] for p in positions],
+            'codes': codes
+        }
+    return segments
+
+def load_library(cursor, user_id: int) -> Dict[str, Any]:
+    """
+    Get user's vector index from the instance cache or the database
+    Without an IVF index every chunk is loaded up front, with one only the
+    centroids and unassigned chunks are, lists are loaded when first probed
+    """
+    from ann import load_index
+    
+    # Version is read before the rows, so a cached index is never newer than it claims
+    version = get_library_version(cursor, user_id)
+    library = get_cached_library(user_id, version)
+    if library is not None:
+        if DEBUG:
+            print(f"[DEBUG] Using cached index with {len(library['segments'])} loaded lists for user {user_id}")
+        return library
+    
+    library = {
+        'version': version,
+        'index': load_index(cursor, user_id),
+        'segments': fetch_segments(cursor, user_id, None)
+    }
+    
+    if DEBUG:
+        print(f"[DEBUG] Loaded index of user {user_id}, {len(library['segments'][None]['ids'])} unindexed chunks")
+    cache_library(user_id, library)
+    return library
+
+def timed(func, *args) -> Tuple[Any, float]:
+    """Run func and return its result with elapsed milliseconds"""
+    started = time.perf_counter()
+    result = func(*args)
+    return result, round((time.perf_counter() - started) * 1000, 1)
+
+def rerank(cursor, candidates: List[Dict[str, Any]], query_vector: Any, user_id: int, timings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Replace approximate similarities of the shortlist with exact ones from float32 vectors"""
+    from vectors import stack_embeddings
+    
+    started = time.perf_counter()
+    with span('fetch'):
+        cursor.execute("""
+            SELECT id, embedding FROM document_chunks
+            WHERE id = ANY(%s) AND user_id = %s
+        """, ([candidate['id'] for candidate in candidates], user_id))
+        rows = cursor.fetchall()
+    
+    with span('score'):
+        matrix, positions = stack_embeddings([row['embedding'] for row in rows], query_vector.shape[0])
+        exact = {rows[p]['id']: float(score) for p, score in zip(positions, matrix @ query_vector)}
+        reranked = [dict(candidate, similarity=exact[candidate['id']]) for candidate in candidates if candidate['id'] in exact]
+    timings['rerank_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return reranked
+
+def vector_search(cursor, library: Dict[str, Any], query_vector: Any, user_id: int, limit: int, timings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Nearest chunks by cosine similarity, through the IVF lists when the library has an index
+    Compact codes pick RERANK_FACTOR * limit candidates, whose float32 vectors decide the final order
+    """
+    from ann import probe_lists
+    from vectors import score_codes, top_scores
+    
+    # IVF search probes the lists nearest to the query, loading those not cached yet
+    keys: List[Optional[int]] = [None]
+    index = library['index']
+    if index is not None and index['dim'] == query_vector.shape[0]:
+        probes = probe_lists(index['centroids'], query_vector, index['nprobe'])
+        missing = [key for key in probes if key not in library['segments']]
+        if missing:
+            segments_started = time.perf_counter()
+            with span('fetch'):
+                library['segments'].update(fetch_segments(cursor, user_id, missing))
+            timings['segments_ms'] = round((time.perf_counter() - segments_started) * 1000, 1)
+            cache_library(user_id, library)
+        keys.extend(probes)
+    
+    # Float32 scores are already exact, codes shortlist extra candidates for the re-rank
+    approximate = any(library['segments'][key]['codes']['kind'] != 'none' for key in keys)
+    shortlist = limit * max(1, RERANK_FACTOR) if approximate else limit
+    
+    # Score candidate chunks against the normalized query,
+    # lower threshold to 0.2 for better recall (applied after the re-rank)
+    scoring_started = time.perf_counter()
+    hits = []
+    with span('score'):
+        for key in keys:
+            segment = library['segments'][key]
+            if segment['codes']['dim'] == query_vector.shape[0]:
+                hits.extend({
+                    'id': segment['ids'][row_index],
+                    'document_id': segment['document_ids'][row_index],
+                    'name': segment['names'][row_index],
+                    'similarity': similarity
+                } for row_index, similarity in top_scores(score_codes(segment['codes'], query_vector), shortlist,
+                                                          min_score=-1.0 if approximate else 0.2))
+        hits = sorted(hits, key=lambda hit: hit['similarity'], reverse=True)[:shortlist]
+    timings['scoring_ms'] = round((time.perf_counter() - scoring_started) * 1000, 1)
+    
+    if approximate and hits:
+        hits = rerank(cursor, hits, query_vector, user_id, timings)
+    hits = [hit for hit in hits if hit['similarity'] > 0.2]
+    return sorted(hits, key=lambda hit: hit['similarity'], reverse=True)[:limit]
+
+def fetch_contents(cursor, hits: List[Dict[str, Any]], user_id: int, timings: Dict[str, Any]) -> Dict[int, str]:
+    """Chunk texts of the final hits, read only after ranking"""
+    if not hits:
+        return {}
+    started = time.perf_counter()
+    with span('fetch'):
+        cursor.execute("""
+            SELECT id, content FROM document_chunks
+            WHERE id = ANY(%s) AND user_id = %s
+        """, ([hit['id'] for hit in hits], user_id))
+        contents = {row['id']: row['content'] for row in cursor.fetchall()}
+    timings['contents_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return contents
+
+def search_documents(query: str, user_id: int, limit: int = 8) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Search chunks of user documents, fusing full-text and vector rankings
+    Short identifier queries whose terms all occur in one chunk are answered
+    from the full-text index without an embedding call, otherwise the query embedding
+    runs concurrently with the text search and the index fetch
+    Returns: relevant chunks and per-stage timings in milliseconds
+    """
+    if DEBUG:
+        print(f"[DEBUG] Starting document search for query: '{query}', user: {user_id}")
+    started = time.perf_counter()
+    timings: Dict[str, Any] = {}
+    exact_term_query = (LEXICAL_FAST_PATH and 0 < len(query.split()) <= LEXICAL_FAST_PATH_MAX_WORDS
+                        and has_identifier(query))
+    
+    try:
+        embedding_future = None
+        if not exact_term_query:
+            embedding_future = _retrieval_executor.submit(copy_context().run, timed, create_embedding, query)
         
-        results = []
-        for row in documents:
-            # Calculate cosine similarity
-            doc_embedding = json.loads(row['embedding'])
-            
-            dot_product = sum(a * b for a, b in zip(query_embedding, doc_embedding))
-            magnitude_query = sum(a * a for a in query_embedding) ** 0.5
-            magnitude_doc = sum(a * a for a in doc_embedding) ** 0.5
+        # The pooled connection is never held while waiting for the embedding,
+        # whose cache lookup needs a connection of its own
+        library = None
+        contents = {}
+        with db_connection() as conn:
+            cursor = dict_cursor(conn)
+            with span('fetch'):
+                lexical_hits, timings['lexical_ms'] = timed(lexical_search, cursor, query, user_id, limit)
             
-            if magnitude_query > 0 and magnitude_doc > 0:
-                similarity = dot_product / (magnitude_query * magnitude_doc)
+            if exact_term_query and lexical_hits and lexical_hits[0]['all_terms']:
+                timings['mode'] = 'lexical'
+                if DEBUG:
+                    print(f"[DEBUG] Lexical fast path, {len(lexical_hits)} chunks match query terms")
+                contents = fetch_contents(cursor, lexical_hits, user_id, timings)
             else:
-                similarity = 0
+                with span('fetch'):
+                    library, timings['library_ms'] = timed(load_library, cursor, user_id)
+            cursor.close()
+        
+        hits = lexical_hits
+        if library is not None:
+            if embedding_future is None:
+                embedding_future = _retrieval_executor.submit(copy_context().run, timed, create_embedding, query)
             
-            print(f"[DEBUG] Document '{row['name']}' similarity: {similarity:.4f}")
+            # With text hits in hand, a slow embeddings call is not waited for past the fallback deadline
+            query_embedding = None
+            try:
+                query_embedding, timings['embedding_ms'] = embedding_future.result(
+                    timeout=EMBEDDING_FALLBACK_SECONDS if lexical_hits else None
+                )
+            except FuturesTimeoutError:
+                if INFO:
+                    print(f"[INFO] Query embedding missed its {EMBEDDING_FALLBACK_SECONDS}s deadline")
             
-            # Lower threshold to 0.2 for better recall
-            if similarity > 0.2:
-                results.append({
-                    'name': row['name'],
-                    'content': row['content'],
-                    'similarity': similarity
-                })
+            with db_connection() as conn:
+                cursor = dict_cursor(conn)
+                if query_embedding is None:
+                    if INFO:
+                        print("[INFO] No query embedding, answering from text search only")
+                    timings['mode'] = 'lexical'
+                    vector_hits = []
+                else:
+                    if DEBUG:
+                        print(f"[DEBUG] Query embedding created, length: {len(query_embedding)}")
+                    timings['mode'] = 'hybrid' if lexical_hits else 'vector'
+                    from vectors import normalize_embedding
+                    vector_hits = vector_search(cursor, library, normalize_embedding(query_embedding), user_id, limit, timings)
+                hits = fuse_hits(vector_hits, lexical_hits, limit)
+                contents = fetch_contents(cursor, hits, user_id, timings)
+                cursor.close()
         
-        # Sort by similarity and return top results
-        results.sort(key=lambda x: x['similarity'], reverse=True)
-        results = results[:limit]
-        
-        print(f"[DEBUG] Returning {len(results)} relevant documents")
+        results = []
+        for hit in hits:
+            if hit['id'] not in contents:
+                continue
+            if DEBUG:
+                print(f"[DEBUG] Chunk {hit['id']} of '{hit['name']}' similarity: {hit.get('similarity', hit.get('rank')):.4f}")
+            results.append({
+                'document_id': hit['document_id'],
+                'name': hit['name'],
+                'content': contents[hit['id']],
+                'similarity': hit.get('similarity', hit.get('rank')),
+                'score': hit.get('score', hit.get('rank'))
+            })
         
-        cursor.close()
-        conn.close()
-        return results
+        if DEBUG:
+            print(f"[DEBUG] Returning {len(results)} relevant chunks")
+        return results, timings
         
     except Exception as e:
         print(f"[ERROR] Document search failed: {e}")
-        return []
+        return [], timings
+    finally:
+        timings['retrieval_ms'] = round((time.perf_counter() - started) * 1000, 1)
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+def cacheable_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Answer metadata worth replaying, per-request timings and instance counters are not"""
+    return {key: metadata[key] for key in ('sources', 'documents_used', 'chunks_used', 'model_used')}
+
+def iter_cached_answer(answer: Dict[str, Any]) -> Iterator[str]:
+    """Replay a cached answer as the same SSE frames a live stream produces"""
+    yield sse_event('sources', {key: value for key, value in answer.items() if key != 'response'})
+    yield sse_event('token', {'content': answer['response']})
+    yield sse_event('done', {'response': answer['response']})
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def iter_chat_stream(openai_data: Dict[str, Any], metadata: Dict[str, Any], cache_key: Optional[str] = None) -> Iterator[str]:
+    """Relay completion tokens as SSE frames, sources first and the full answer last"""
+    yield sse_event('sources', metadata)
+    
+    completion_started = time.perf_counter()
+    try:
+        response = openai_post("/chat/completions", {**openai_data, "stream": True}, deadline=COMPLETION_DEADLINE, stream=True)
+        
+        if response.status_code != 200:
+            yield sse_event('error', {'error': 'OpenAI API error', 'detail': response.text})
+            return
+        
+        parts = []
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                # Upstream frames look like "data: {...}" and end with "data: [DONE]"
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                choices = json.loads(payload).get('choices') or [{}]
+                token = choices[0].get('delta', {}).get('content')
+                if token:
+                    parts.append(token)
+                    yield sse_event('token', {'content': token})
+        finally:
+            # Hands the keep-alive connection back to the session pool
+            response.close()
+        
+        if cache_key is not None:
+            store_answer(cache_key, {'response': ''.join(parts), **cacheable_metadata(metadata)})
+        yield sse_event('done', {'response': ''.join(parts)})
+        
+    except Exception as e:
+        print(f"[ERROR] Chat streaming failed: {e}")
+        yield sse_event('error', {'error': 'Internal server error', 'detail': str(e)})
+    finally:
+        # Runs after the headers went out, so this span shows up in the request log line only
+        timer = current_timer()
+        if timer is not None:
+            timer.add('completion', (time.perf_counter() - completion_started) * 1000)
+
+@instrumented('chat')
+def stream_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
-    Business: AI chat with semantic search over user documents
-    Args: event - dict with httpMethod, body, headers
-          context - object with request_id
-    Returns: HTTP response with AI answer and sources
+    Same as handler, but a streaming response keeps an iterator of SSE frames
+    as its body for runtimes that can relay it incrementally
     """
     method: str = event.get('httpMethod', 'GET')
     headers = event.get('headers', {})
     
-    # Get user ID from header
-    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
-    
     # Handle CORS OPTIONS request
     if method == 'OPTIONS':
         return {
@@ -154,7 +483,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -172,6 +501,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    # Session token issued by the auth function, verified locally without a DB lookup
+    try:
+        user_id = authenticate(headers)
+    except Exception as e:
+        print(f"[ERROR] Session verification failed: {e}")
+        user_id = None
+    
     if not user_id:
         return {
             'statusCode': 401,
@@ -179,20 +515,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'error': 'Missing X-User-Id header'}),
-            'isBase64Encoded': False
-        }
-    
-    try:
-        user_id = int(user_id)
-    except:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Invalid user ID'}),
+            'body': json.dumps({'error': 'Missing or expired session token'}),
             'isBase64Encoded': False
         }
     
@@ -201,6 +524,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         body_data = json.loads(event.get('body', '{}'))
         message = body_data.get('message', '')
         conversation_history = body_data.get('conversation_history', [])
+        stream = bool(body_data.get('stream', False))
+        use_cache = ANSWER_CACHE_ENABLED and body_data.get('cache', True) is not False
     except Exception as e:
         return {
             'statusCode': 400,
@@ -225,75 +550,116 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    # Search relevant documents
-    print(f"[INFO] Searching documents for user {user_id} with query: {message}")
-    relevant_docs = search_documents(message, user_id)
-    print(f"[INFO] Found {len(relevant_docs)} relevant documents")
-    
-    # Prepare conversation with context
-    messages = []
-    
-    # System prompt with document context
-    if relevant_docs:
-        doc_context = "\n\n".join([
-            f"Document: {doc['name']}\nContent: {doc['content']}"
-            for doc in relevant_docs
-        ])
-        system_content = f"""You are a helpful AI assistant with access to the user's personal knowledge base. 
-Use the following documents from their library to answer questions:
-
-{doc_context}
-
-When answering:
-1. Base your response on the provided documents when relevant
-2. If information isn't in the documents, you can provide general knowledge but mention it's not from their documents
-3. Cite which documents you're referencing when using them
-4. Be helpful and accurate
-5. Respond in the same language as the user's question"""
-    else:
-        system_content = """You are a helpful AI assistant. The user has a document library, but no relevant documents were found for this query. 
-Answer based on your general knowledge and mention that no relevant documents were found in their library."""
+    # Identical question, prompt history and library version reuse the stored answer
+    cache_key = None
+    if use_cache:
+        try:
+            with db_connection() as conn:
+                cursor = dict_cursor(conn)
+                version = get_library_version(cursor, user_id)
+                cursor.close()
+            cache_key = answer_key(user_id, version, message, conversation_history[-MAX_HISTORY_MESSAGES:])
+        except Exception as e:
+            print(f"[ERROR] Answer cache lookup failed: {e}")
+        
+        cached_answer = lookup_answer(cache_key) if cache_key else None
+        if cached_answer is not None:
+            if INFO:
+                print(f"[INFO] Answer cache hit for user {user_id}")
+            cached_answer = {**cached_answer, 'cached': True, 'answer_cache': answer_cache_stats()}
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'text/event-stream' if stream else 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': iter_cached_answer(cached_answer) if stream else json.dumps(cached_answer),
+                'isBase64Encoded': False
+            }
     
-    messages.append({"role": "system", "content": system_content})
+    # Search relevant document chunks
+    if INFO:
+        print(f"[INFO] Searching documents for user {user_id}, message of {len(message)} characters")
+    relevant_docs, retrieval_timings = search_documents(message, user_id)
+    if INFO:
+        print(f"[INFO] Found {len(relevant_docs)} relevant chunks")
     
-    # Add conversation history (last 10 messages)
-    for msg in conversation_history[-10:]:
-        messages.append({"role": msg.get('role', 'user'), "content": msg.get('content', '')})
+    # Fit excerpts and history into the prompt token budget
+    with span('prompt'):
+        system_template = DOCUMENTS_PROMPT.format(doc_context='') if relevant_docs else NO_DOCUMENTS_PROMPT
+        relevant_docs, history, context_report = assemble_context(
+            relevant_docs, conversation_history, message, system_template
+        )
+        
+        # Prepare conversation with context
+        messages = []
+        
+        # System prompt with document context
+        if relevant_docs:
+            doc_context = "\n\n".join([
+                f"Document: {doc['name']}\nExcerpt: {doc['content']}"
+                for doc in relevant_docs
+            ])
+            system_content = DOCUMENTS_PROMPT.format(doc_context=doc_context)
+        else:
+            system_content = NO_DOCUMENTS_PROMPT
+        
+        messages.append({"role": "system", "content": system_content})
+        
+        # Add conversation history that fits the budget (at most last 10 messages)
+        for msg in history:
+            messages.append({"role": msg.get('role', 'user'), "content": msg.get('content', '')})
+        
+        # Add current message
+        messages.append({"role": "user", "content": message})
+    
+    # Prepare response with detailed sources, one per document with its best chunk score
+    sources = []
+    seen_documents = set()
+    for doc in relevant_docs:
+        if doc['document_id'] in seen_documents:
+            continue
+        seen_documents.add(doc['document_id'])
+        sources.append({
+            'id': len(sources) + 1,
+            'name': doc['name'],
+            'relevance': doc['similarity']
+        })
     
-    # Add current message
-    messages.append({"role": "user", "content": message})
+    metadata = {
+        'sources': sources,
+        'documents_used': len(sources),
+        'chunks_used': len(relevant_docs),
+        'context': context_report,
+        'embedding_cache': cache_stats(),
+        'timings': retrieval_timings,
+        'model_used': CHAT_MODEL
+    }
     
     # Prepare OpenAI request
     openai_data = {
-        "model": "gpt-4o-mini",
+        "model": CHAT_MODEL,
         "messages": messages,
         "max_tokens": 1000,
         "temperature": 0.7
     }
     
-    headers = {
-        "Authorization": f"Bearer {openai_api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    # Check if proxy is configured
-    proxy_url = os.getenv('PROXY_URL')
-    proxies = {}
-    if proxy_url:
-        proxies = {
-            'http': proxy_url,
-            'https': proxy_url
+    if stream:
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'text/event-stream',
+                'Cache-Control': 'no-cache',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': iter_chat_stream(openai_data, metadata, cache_key),
+            'isBase64Encoded': False
         }
     
     try:
         # Make request to OpenAI
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=openai_data,
-            proxies=proxies,
-            timeout=30
-        )
+        with span('completion'):
+            response = openai_post("/chat/completions", openai_data, deadline=COMPLETION_DEADLINE)
         
         if response.status_code != 200:
             return {
@@ -311,21 +677,13 @@ Answer based on your general knowledge and mention that no relevant documents we
         
         ai_response = response.json()['choices'][0]['message']['content']
         
-        # Prepare response with detailed sources
-        sources = []
-        for i, doc in enumerate(relevant_docs):
-            sources.append({
-                'id': i + 1,
-                'name': doc['name'],
-                'relevance': doc['similarity']
-            })
-        
         result = {
             'response': ai_response,
-            'sources': sources,
-            'documents_used': len(relevant_docs),
-            'model_used': 'gpt-4o-mini'
+            **metadata
         }
+        if cache_key is not None:
+            store_answer(cache_key, {'response': ai_response, **cacheable_metadata(metadata)})
+            result['answer_cache'] = answer_cache_stats()
         
         return {
             'statusCode': 200,
@@ -350,4 +708,18 @@ Answer based on your general knowledge and mention that no relevant documents we
                 'detail': str(e)
             }),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Business: AI chat with semantic search over user documents
+    Args: event - dict with httpMethod, body (message, conversation_history, stream), headers
+          context - object with request_id
+    Returns: HTTP response with AI answer and sources, or SSE frames when stream is true
+    """
+    response = stream_handler(event, context)
+    
+    # Function responses are delivered whole, so SSE frames are joined into one body
+    if not isinstance(response['body'], str):
+        response['body'] = ''.join(response['body'])
+    return response
@@ -0,0 +1,58 @@
+import re
+from collections import defaultdict
+from typing import Any, Dict, List
+
+# Reciprocal Rank Fusion constant, dampens the weight of top ranks
+RRF_K = 60
+# Codes, numbers and names like INV-2023-0042, v1.2, snake_case or camelCase
+IDENTIFIER_TOKEN = re.compile(r'\d|\w[_./#:]\w|[a-z][A-Z]')
+
+def has_identifier(query: str) -> bool:
+    """Whether a query term looks like an identifier, which text search matches exactly"""
+    return any(IDENTIFIER_TOKEN.search(term) for term in query.split())
+
+def lexical_search(cursor, query: str, user_id: int, limit: int) -> List[Dict[str, Any]]:
+    """
+    Full-text search over the user's chunks, any query term may match
+    Query terms are parsed by Postgres like the indexed text, so identifiers
+    such as INV-2023-0042 split the same way on both sides
+    Returns hits with id, document_id, name, rank in [0, 1) and whether
+    the chunk contains every term, best first
+    """
+    if not query.strip():
+        return []
+    cursor.execute("""
+        WITH q AS (
+            SELECT plainto_tsquery('simple', %s) AS all_terms,
+                   replace(plainto_tsquery('simple', %s)::text, ' & ', ' | ')::tsquery AS any_terms
+        )
+        SELECT c.id, c.document_id, d.name,
+               ts_rank_cd(c.search_vector, q.any_terms, 32) AS rank,
+               c.search_vector @@ q.all_terms AS all_terms
+        FROM q, document_chunks c
+        JOIN documents d ON d.id = c.document_id
+        WHERE c.user_id = %s AND c.search_vector @@ q.any_terms
+        ORDER BY rank DESC, c.id
+        LIMIT %s
+    """, (query, query, user_id, limit))
+    return [dict(row) for row in cursor.fetchall()]
+
+def fuse_hits(vector_hits: List[Dict[str, Any]], lexical_hits: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """
+    Merge ranked vector and lexical hits with Reciprocal Rank Fusion
+    Chunks keep their cosine similarity, lexical-only ones report their text rank
+    """
+    scores: Dict[int, float] = defaultdict(float)
+    entries: Dict[int, Dict[str, Any]] = {}
+    for hits in (vector_hits, lexical_hits):
+        for position, hit in enumerate(hits):
+            scores[hit['id']] += 1.0 / (RRF_K + position + 1)
+            entries.setdefault(hit['id'], {
+                'id': hit['id'],
+                'document_id': hit['document_id'],
+                'name': hit['name'],
+                'similarity': hit.get('similarity', hit.get('rank', 0.0))
+            })
+    
+    ranked = sorted(scores, key=lambda chunk_id: scores[chunk_id], reverse=True)[:limit]
+    return [{**entries[chunk_id], 'score': scores[chunk_id]} for chunk_id in ranked]
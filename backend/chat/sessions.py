@@ -0,0 +1,70 @@
+import base64
+import hashlib
+import hmac
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# Tokens are "v1.<user_id>.<expires>.<signature>", signed with HMAC-SHA256 over
+# the first three fields, so any function holding SESSION_SECRET verifies them locally
+TOKEN_VERSION = 'v1'
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', str(7 * 24 * 3600)))
+
+# Verified tokens skip the HMAC on repeat requests of a warm instance. Entries are
+# keyed by secret and token, so a rotated SESSION_SECRET invalidates them at once
+VERIFIED_CACHE_SIZE = 1024
+_verified: 'OrderedDict[Tuple[bytes, str], Tuple[int, int]]' = OrderedDict()
+
+def get_secret() -> bytes:
+    """Signing key shared by auth, chat and documents"""
+    secret = os.getenv('SESSION_SECRET')
+    if not secret:
+        raise Exception("SESSION_SECRET not configured")
+    return secret.encode('utf-8')
+
+def sign(message: str) -> str:
+    """URL-safe HMAC-SHA256 signature without padding"""
+    digest = hmac.new(get_secret(), message.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+def issue_token(user_id: int, ttl: int = SESSION_TTL_SECONDS) -> str:
+    """Signed session token for the user, valid for ttl seconds"""
+    message = f"{TOKEN_VERSION}.{int(user_id)}.{int(time.time()) + ttl}"
+    return f"{message}.{sign(message)}"
+
+def verify_token(token: str) -> Optional[int]:
+    """User id of a valid, unexpired token, None otherwise"""
+    now = time.time()
+    key = (get_secret(), token)
+    cached = _verified.get(key)
+    if cached is not None:
+        if cached[1] > now:
+            _verified.move_to_end(key)
+            return cached[0]
+        del _verified[key]
+        return None
+    
+    parts = token.split('.')
+    if len(parts) != 4 or parts[0] != TOKEN_VERSION:
+        return None
+    try:
+        user_id = int(parts[1])
+        expires = int(parts[2])
+    except ValueError:
+        return None
+    if expires <= now or not hmac.compare_digest(parts[3], sign('.'.join(parts[:3]))):
+        return None
+    
+    _verified[key] = (user_id, expires)
+    while len(_verified) > VERIFIED_CACHE_SIZE:
+        _verified.popitem(last=False)
+    return user_id
+
+def authenticate(headers: Dict[str, Any]) -> Optional[int]:
+    """User id from an "Authorization: Bearer <token>" header, None when missing or invalid"""
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return verify_token(token.strip())
@@ -0,0 +1,28 @@
+from db import get_db_connection, release_db_connection
+
+def run_backfill() -> int:
+    """
+    Business: Queue documents uploaded before chunk-level retrieval for the ingest worker
+    Returns: number of documents queued
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO ingest_jobs (document_id)
+            SELECT d.id
+            FROM documents d
+            WHERE NOT EXISTS (SELECT 1 FROM document_chunks c WHERE c.document_id = d.id)
+              AND NOT EXISTS (SELECT 1 FROM ingest_jobs j WHERE j.document_id = d.id)
+        """)
+        queued = cursor.rowcount
+        conn.commit()
+        cursor.close()
+    finally:
+        release_db_connection(conn)
+
+    print(f"[INFO] Queued {queued} documents for chunking")
+    return queued
+
+if __name__ == '__main__':
+    run_backfill()
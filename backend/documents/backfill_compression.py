@@ -0,0 +1,61 @@
+import sys
+from typing import Tuple
+import psycopg2.extras
+from compression import COMPRESSION_MIN_BYTES, encode_content
+from db import dict_cursor, get_db_connection, release_db_connection
+
+def backfill_batch(conn, after_id: int, batch_size: int) -> Tuple[int, int, int]:
+    """Compress one batch of plain-text documents, returns (rows seen, rows compressed, last id)"""
+    cursor = dict_cursor(conn)
+
+    # SKIP LOCKED lets several backfill runs share the work safely
+    cursor.execute("""
+        SELECT id, content
+        FROM documents
+        WHERE content_codec IS NULL AND octet_length(content) >= %s AND id > %s
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (COMPRESSION_MIN_BYTES, after_id, batch_size))
+    rows = cursor.fetchall()
+
+    updates = []
+    for row in rows:
+        content, compressed, codec = encode_content(row['content'])
+        # Incompressible text stays as it is
+        if codec is not None:
+            updates.append((psycopg2.Binary(compressed), codec, row['id']))
+
+    psycopg2.extras.execute_batch(cursor, """
+        UPDATE documents SET content = NULL, content_compressed = %s, content_codec = %s
+        WHERE id = %s
+    """, updates)
+
+    conn.commit()
+    cursor.close()
+    return len(rows), len(updates), (rows[-1]['id'] if rows else after_id)
+
+def run_backfill(batch_size: int = 100) -> int:
+    """
+    Business: Resumable compression of document text stored before V0013
+    Args: batch_size - documents compressed and committed per transaction
+    Returns: total number of documents compressed
+    """
+    conn = get_db_connection()
+    total = 0
+    last_id = 0
+    try:
+        while True:
+            seen, compressed, last_id = backfill_batch(conn, last_id, batch_size)
+            if seen == 0:
+                break
+            total += compressed
+            print(f"[INFO] Compressed {total} documents so far (last id {last_id})")
+    finally:
+        release_db_connection(conn)
+
+    print(f"[INFO] Backfill finished, {total} documents compressed")
+    return total
+
+if __name__ == '__main__':
+    run_backfill(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,65 @@
+import json
+import sys
+from typing import Tuple
+import psycopg2.extras
+from vectors import normalize_embedding, pack_embedding
+from db import dict_cursor, get_db_connection, release_db_connection
+
+def backfill_batch(conn, after_id: int, batch_size: int) -> Tuple[int, int]:
+    """Convert one batch of legacy JSON embeddings, returns (rows seen, last id)"""
+    cursor = dict_cursor(conn)
+
+    # SKIP LOCKED lets several backfill runs share the work safely
+    cursor.execute("""
+        SELECT id, embedding_json
+        FROM documents
+        WHERE embedding IS NULL AND embedding_json IS NOT NULL AND id > %s
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    """, (after_id, batch_size))
+    rows = cursor.fetchall()
+
+    updates = []
+    for row in rows:
+        try:
+            packed = pack_embedding(normalize_embedding(json.loads(row['embedding_json'])))
+        except (ValueError, TypeError) as e:
+            # Leave the row untouched so it can be inspected and fixed by hand
+            print(f"[ERROR] Document {row['id']} has malformed embedding: {e}")
+            continue
+        updates.append((packed, row['id']))
+
+    psycopg2.extras.execute_batch(cursor, """
+        UPDATE documents SET embedding = %s, embedding_json = NULL
+        WHERE id = %s
+    """, updates)
+
+    conn.commit()
+    cursor.close()
+    return len(rows), (rows[-1]['id'] if rows else after_id)
+
+def run_backfill(batch_size: int = 200) -> int:
+    """
+    Business: Resumable conversion of JSON text embeddings to packed float32
+    Args: batch_size - rows converted and committed per transaction
+    Returns: total number of rows processed
+    """
+    conn = get_db_connection()
+    total = 0
+    last_id = 0
+    try:
+        while True:
+            seen, last_id = backfill_batch(conn, last_id, batch_size)
+            if seen == 0:
+                break
+            total += seen
+            print(f"[INFO] Processed {total} embeddings so far (last id {last_id})")
+    finally:
+        release_db_connection(conn)
+
+    print(f"[INFO] Backfill finished, {total} embeddings processed")
+    return total
+
+if __name__ == '__main__':
+    run_backfill(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,68 @@
+import os
+from typing import List, Tuple
+
+# Chunk sizes are in characters, overlap keeps context across chunk borders
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '2000'))
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '200'))
+
+# Preferred split points, strongest first
+BREAKS = ['\n\n', '\n', '. ', ' ']
+
+def find_break(text: str, start: int, end: int) -> int:
+    """Find the last natural break in the second half of text[start:end]"""
+    floor = start + (end - start) // 2
+    for separator in BREAKS:
+        position = text.rfind(separator, floor, end)
+        if position != -1:
+            return position + len(separator)
+    return end
+
+def chunk_spans(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Tuple[int, int]]:
+    """(start, end) offsets of overlapping chunks, breaking on paragraphs, lines or words"""
+    overlap = min(overlap, chunk_size // 2)
+    spans = []
+    start = 0
+    
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            end = find_break(text, start, end)
+        
+        spans.append((start, end))
+        if end >= len(text):
+            break
+        
+        # Step back by the overlap, then forward to the next word boundary
+        start = max(end - overlap, start + 1)
+        boundary = text.find(' ', start, end)
+        if boundary != -1:
+            start = boundary + 1
+    
+    return spans
+
+def split_into_chunks(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Split text into overlapping chunks, breaking on paragraphs, lines or words"""
+    chunks = []
+    for start, end in chunk_spans(text, chunk_size, overlap):
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+    return chunks
+
+def split_streaming(text: str, final: bool) -> Tuple[List[str], str]:
+    """
+    Chunk text that arrives in parts, with the same chunks as splitting it whole
+    Args: text - tail carried from the previous part followed by the new part
+          final - no more parts follow
+    Returns: chunks that later text cannot change and the tail to carry into the next part
+    """
+    if final:
+        return split_into_chunks(text), ''
+    
+    # Every span but the last ends on a break inside text, the last may end early
+    # only because the text does and is split again once the next part is in
+    spans = chunk_spans(text)
+    if not spans:
+        return [], text
+    chunks = [text[start:end].strip() for start, end in spans[:-1]]
+    return [chunk for chunk in chunks if chunk], text[spans[-1][0]:]
@@ -0,0 +1,64 @@
+import os
+import zlib
+from typing import Any, Iterable, Optional, Tuple
+
+# Codec of newly stored document text, every row keeps the codec it was written with
+CONTENT_CODEC = os.getenv('CONTENT_CODEC', 'zlib')
+# Shorter texts stay plain, compression would save next to nothing on them
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+ZLIB_LEVEL = 6
+
+COMPRESSORS = {'zlib': lambda data: zlib.compress(data, ZLIB_LEVEL)}
+DECOMPRESSORS = {'zlib': zlib.decompress}
+# Incremental compressors for text that arrives in pieces, e.g. chunked uploads
+STREAM_COMPRESSORS = {'zlib': lambda: zlib.compressobj(ZLIB_LEVEL)}
+
+def encode_content(text: str) -> Tuple[Optional[str], Optional[bytes], Optional[str]]:
+    """Column values (content, content_compressed, content_codec) for document text"""
+    data = text.encode('utf-8')
+    if CONTENT_CODEC == 'none' or len(data) < COMPRESSION_MIN_BYTES:
+        return text, None, None
+    if CONTENT_CODEC not in COMPRESSORS:
+        raise ValueError(f"Unknown content codec {CONTENT_CODEC}")
+    
+    compressed = COMPRESSORS[CONTENT_CODEC](data)
+    if len(compressed) >= len(data):
+        return text, None, None
+    return None, compressed, CONTENT_CODEC
+
+def compress_pieces(pieces: Iterable[str]) -> Tuple[Optional[bytes], Optional[str]]:
+    """
+    Compress text given in pieces without ever joining it, memory stays at the compressed size
+    Returns: (content_compressed, content_codec), both None when the text should stay plain
+    under the same rules as encode_content
+    """
+    if CONTENT_CODEC == 'none':
+        return None, None
+    if CONTENT_CODEC not in STREAM_COMPRESSORS:
+        raise ValueError(f"Unknown content codec {CONTENT_CODEC}")
+    
+    compressor = STREAM_COMPRESSORS[CONTENT_CODEC]()
+    output = []
+    size = 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        size += len(data)
+        output.append(compressor.compress(data))
+    output.append(compressor.flush())
+    
+    compressed = b''.join(output)
+    if size < COMPRESSION_MIN_BYTES or len(compressed) >= size:
+        return None, None
+    return compressed, CONTENT_CODEC
+
+def decode_content(content: Optional[str], compressed: Any, codec: Optional[str]) -> str:
+    """Document text from its stored columns, compressed bytes may be a memoryview"""
+    if codec is None:
+        return content
+    if codec not in DECOMPRESSORS:
+        raise ValueError(f"Unknown content codec {codec}")
+    return DECOMPRESSORS[codec](bytes(compressed)).decode('utf-8')
+
+def row_content(row) -> str:
+    """Decode the content columns of a fetched documents row"""
+    return decode_content(row['content'], row['content_compressed'], row['content_codec'])
@@ -1,115 +1,118 @@
 import json
 import os
-import psycopg2
-import psycopg2.extras
-import requests
-from typing import Dict, Any, List, Optional
+import time
+from typing import Dict, Any, List, Tuple
 from datetime import datetime
 import base64
+from sessions import authenticate
+from timing import DEBUG, INFO, instrumented, span
+from db import db_connection, dict_cursor, get_db_connection, release_db_connection
+from compression import row_content
 
-def get_db_connection():
-    """Get database connection using environment variable"""
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        raise Exception("DATABASE_URL not configured")
-    return psycopg2.connect(database_url)
+# Documents accepted by one batch upload request
+MAX_BATCH_DOCUMENTS = 20
+# Chunked upload: upload_init, then upload_part with part_number 0, 1, 2, ...
+# and upload_finalize, upload_status tells a client where to resume (see uploads.py)
+UPLOAD_ACTIONS = ('upload_init', 'upload_part', 'upload_status', 'upload_finalize')
+# Request bodies past this are refused before parsing, larger files go through the chunked upload
+MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', str(8 * 1024 * 1024)))
 
-def create_embedding(text: str) -> Optional[List[float]]:
-    """Create embedding for text using OpenAI API"""
-    openai_api_key = os.getenv('OPENAI_API_KEY')
-    if not openai_api_key:
-        print("[INFO] No OpenAI API key, skipping embedding")
-        return None
+# Queued uploads are embedded by the ingest function on a timer. Optionally an upload
+# request also embeds its own new documents after it commits, within this many
+# seconds and at most INLINE_WORKER_MAX_CHUNKS chunks, which fit one embeddings request
+INLINE_WORKER_BUDGET = float(os.getenv('INLINE_WORKER_BUDGET', '0'))
+INLINE_WORKER_MAX_CHUNKS = int(os.getenv('INLINE_WORKER_MAX_CHUNKS', '64'))
+
+# Library listing page sizes
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def embed_uploads_inline(conn, document_ids: List[int]) -> None:
+    """Start embedding the caller's new documents, whatever is left stays queued for the ingest function"""
+    if INLINE_WORKER_BUDGET <= 0 or not document_ids:
+        return
+    from worker import process_batch
     
     try:
-        headers = {
-            "Authorization": f"Bearer {openai_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        data = {
-            "model": "text-embedding-3-small",
-            "input": text[:8000]  # Limit text length
-        }
-        
-        # Check if proxy is configured
-        proxy_url = os.getenv('PROXY_URL')
-        proxies = {}
-        if proxy_url:
-            proxies = {
-                'http': proxy_url,
-                'https': proxy_url
-            }
-            print("[INFO] Using proxy for OpenAI embedding request")
-        
-        response = requests.post(
-            "https://api.openai.com/v1/embeddings",
-            headers=headers,
-            json=data,
-            timeout=10,
-            proxies=proxies
-        )
-        
-        if response.status_code == 200:
-            embedding = response.json()['data'][0]['embedding']
-            print(f"[INFO] Created embedding with {len(embedding)} dimensions")
-            return embedding
-        else:
-            print(f"[ERROR] OpenAI API error: {response.status_code}")
-            return None
+        with span('ingest'):
+            counts = process_batch(conn, len(document_ids), document_ids, INLINE_WORKER_MAX_CHUNKS,
+                                   time.monotonic() + INLINE_WORKER_BUDGET)
+        if DEBUG:
+            print(f"[DEBUG] Inline ingest: {counts}")
+    except Exception as e:
+        # The upload is already committed, its job stays queued
+        print(f"[ERROR] Inline ingest failed: {e}")
+
+def encode_cursor(created_at: datetime, doc_id: int) -> str:
+    """Opaque keyset cursor pointing after the given (created_at, id)"""
+    return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), doc_id]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor_value: str) -> Tuple[datetime, int]:
+    """Parse cursor from encode_cursor, raises ValueError when malformed"""
+    try:
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(cursor_value.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(doc_id)
     except Exception as e:
-        print(f"[ERROR] Failed to create embedding: {e}")
-        return None
+        raise ValueError(f"Invalid cursor: {e}")
 
 def search_similar_documents(query_embedding: List[float], user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
-    """Search for similar documents using cosine similarity"""
+    """
+    Search for similar documents using cosine similarity
+    Vectors are scored first, name and content are read for the top ids only
+    """
+    from vectors import normalize_embedding, stack_embeddings, top_k
+    
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        # Get all documents with embeddings for this user
-        cursor.execute("""
-            SELECT id, name, content, file_type, created_at, embedding
-            FROM documents 
-            WHERE embedding IS NOT NULL AND user_id = %s
-        """, (user_id,))
-        
-        results = []
-        for row in cursor.fetchall():
-            # Calculate cosine similarity
-            doc_embedding = json.loads(row['embedding'])
+        with db_connection() as conn:
+            cursor = dict_cursor(conn)
             
-            # Cosine similarity calculation
-            dot_product = sum(a * b for a, b in zip(query_embedding, doc_embedding))
-            magnitude_query = sum(a * a for a in query_embedding) ** 0.5
-            magnitude_doc = sum(a * a for a in doc_embedding) ** 0.5
+            # Phase 1: ids and vectors of all documents with embeddings for this user
+            cursor.execute("""
+                SELECT id, embedding
+                FROM documents 
+                WHERE embedding IS NOT NULL AND user_id = %s
+            """, (user_id,))
+            candidates = cursor.fetchall()
             
-            if magnitude_query > 0 and magnitude_doc > 0:
-                similarity = dot_product / (magnitude_query * magnitude_doc)
-            else:
-                similarity = 0
+            # Score every document at once against the normalized query
+            with span('score'):
+                query_vector = normalize_embedding(query_embedding)
+                matrix, positions = stack_embeddings([row['embedding'] for row in candidates], query_vector.shape[0])
+                hits = [(candidates[positions[row_index]]['id'], similarity) for row_index, similarity in top_k(matrix, query_vector, limit)]
+            if not hits:
+                cursor.close()
+                return []
             
+            # Phase 2: full rows of the best matches, only these are decompressed
+            cursor.execute("""
+                SELECT id, name, content, content_compressed, content_codec, file_type, created_at
+                FROM documents
+                WHERE id = ANY(%s) AND user_id = %s
+            """, ([doc_id for doc_id, _ in hits], user_id))
+            documents = {row['id']: row for row in cursor.fetchall()}
+            cursor.close()
+        
+        results = []
+        for doc_id, similarity in hits:
+            row = documents.get(doc_id)
+            if row is None:
+                continue
             results.append({
                 'id': row['id'],
                 'name': row['name'],
-                'content': row['content'],
+                'content': row_content(row),
                 'file_type': row['file_type'],
                 'created_at': row['created_at'].isoformat() if row['created_at'] else None,
                 'similarity_score': similarity
             })
         
-        # Sort by similarity and return top results
-        results.sort(key=lambda x: x['similarity_score'], reverse=True)
-        results = results[:limit]
-        
-        cursor.close()
-        conn.close()
         return results
         
     except Exception as e:
         print(f"[ERROR] Search failed: {e}")
         return []
 
+@instrumented('documents')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Business: Document storage with PDF support and embeddings
@@ -117,14 +120,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
           context - function context
     Returns: HTTP response dict
     """
-    print(f"[DEBUG] Request received")
-    
     method = event.get('httpMethod', 'GET')
     headers = event.get('headers', {})
-    
-    # Get user ID from header
-    user_id = headers.get('X-User-Id') or headers.get('x-user-id')
-    print(f"[DEBUG] Method: {method}, User-ID: {user_id}")
+    if DEBUG:
+        print(f"[DEBUG] Request received, method: {method}")
     
     # Always handle OPTIONS first
     if method == 'OPTIONS':
@@ -133,7 +132,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -141,6 +140,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     # Check auth
+    # Session token issued by the auth function, verified locally without a DB lookup
+    try:
+        user_id = authenticate(headers)
+    except Exception as e:
+        print(f"[ERROR] Session verification failed: {e}")
+        user_id = None
+    
     if not user_id:
         return {
             'statusCode': 401,
@@ -148,55 +154,115 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'error': 'Missing X-User-Id header'}),
-            'isBase64Encoded': False
-        }
-    
-    try:
-        user_id = int(user_id)
-    except:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Invalid user ID'}),
+            'body': json.dumps({'error': 'Missing or expired session token'}),
             'isBase64Encoded': False
         }
     
+    conn = None
     try:
+        # One pooled connection serves the whole request and is returned in finally
         conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor = dict_cursor(conn)
         
         if method == 'GET':
-            # Get all documents from database
-            cursor.execute("""
-                SELECT id, name, content, file_type, created_at, 
-                       CASE WHEN embedding IS NOT NULL THEN true ELSE false END as has_embedding
-                FROM documents 
-                WHERE user_id = %s
-                ORDER BY created_at DESC
-            """, (user_id,))
+            # Keyset pagination: ?limit=N&cursor=<next_cursor of the previous page>,
+            # ?id=N opens one document with its full content
+            query_params = event.get('queryStringParameters', {}) or {}
+            try:
+                doc_id = int(query_params['id']) if query_params.get('id') else None
+                limit = int(query_params.get('limit', DEFAULT_PAGE_SIZE))
+                if not 1 <= limit <= MAX_PAGE_SIZE:
+                    raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+                after = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+            except ValueError as e:
+                cursor.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'error': str(e)}),
+                    'isBase64Encoded': False
+                }
+            
+            if doc_id is not None:
+                with span('fetch'):
+                    cursor.execute("""
+                        SELECT id, name, content, content_compressed, content_codec, file_type, created_at,
+                               embedding IS NOT NULL AS has_embedding
+                        FROM documents
+                        WHERE id = %s AND user_id = %s
+                    """, (doc_id, user_id))
+                    row = cursor.fetchone()
+                cursor.close()
+                
+                if row is None:
+                    return {
+                        'statusCode': 404,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Document not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                # Opening a document is the one request that decompresses its text
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'document': {
+                        'id': row['id'],
+                        'name': row['name'],
+                        'content': row_content(row),
+                        'file_type': row['file_type'],
+                        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+                        'has_embedding': row['has_embedding']
+                    }}),
+                    'isBase64Encoded': False
+                }
+            
+            # Preview is precomputed, full content is never read for the listing
+            columns = """
+                SELECT id, name, COALESCE(preview, left(content, 200)) AS preview, file_type, created_at,
+                       embedding IS NOT NULL AS has_embedding
+                FROM documents
+            """
+            with span('fetch'):
+                if after is None:
+                    cursor.execute(columns + """
+                        WHERE user_id = %s
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT %s
+                    """, (user_id, limit + 1))
+                else:
+                    cursor.execute(columns + """
+                        WHERE user_id = %s AND (created_at, id) < (%s, %s)
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT %s
+                    """, (user_id, after[0], after[1], limit + 1))
+                rows = cursor.fetchall()
+            cursor.close()
             
             documents = []
-            for row in cursor.fetchall():
-                # Show preview of content in list
-                content = row['content']
-                if len(content) > 200:
-                    content = content[:200] + '...'
-                    
+            for row in rows[:limit]:
                 documents.append({
                     'id': row['id'],
                     'name': row['name'],
-                    'content': content,
+                    'content': row['preview'],
                     'file_type': row['file_type'],
                     'created_at': row['created_at'].isoformat() if row['created_at'] else None,
                     'has_embedding': row['has_embedding']
                 })
             
-            cursor.close()
-            conn.close()
+            # One extra row tells whether another page exists
+            next_cursor = None
+            if len(rows) > limit:
+                next_cursor = encode_cursor(rows[limit - 1]['created_at'], rows[limit - 1]['id'])
             
             return {
                 'statusCode': 200,
@@ -204,85 +270,122 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({'documents': documents}),
+                'body': json.dumps({'documents': documents, 'next_cursor': next_cursor}),
                 'isBase64Encoded': False
             }
             
         elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            print(f"[DEBUG] Upload request for user {user_id}")
+            # Ingest and index maintenance pull in numpy, listing requests never load them
+            from ingest import ingest_documents
+            from ann import bump_library_version, maintain_index
             
-            conn = get_db_connection()
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            
-            name = body.get('name', 'Untitled')
-            content = body.get('content', '')
-            file_type = body.get('file_type', 'text/plain')
-            
-            # Only accept text files
-            if file_type != 'text/plain' and not name.endswith('.txt'):
+            raw_body = event.get('body') or '{}'
+            if len(raw_body) > MAX_REQUEST_BYTES:
                 cursor.close()
-                conn.close()
                 return {
-                    'statusCode': 400,
+                    'statusCode': 413,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
                     'body': json.dumps({
-                        'error': 'Only text files (.txt) are supported.'
+                        'error': 'Request too large. Upload large files in parts with upload_init, upload_part and upload_finalize.'
                     }),
                     'isBase64Encoded': False
                 }
             
-            # Check file size limit (5MB)
-            if len(content) > 5 * 1024 * 1024:
+            body = json.loads(raw_body)
+            if DEBUG:
+                print(f"[DEBUG] Upload request for user {user_id}")
+            
+            # Chunked upload: {"action": "upload_init" | "upload_part" | "upload_status" | "upload_finalize", ...}
+            if body.get('action') in UPLOAD_ACTIONS:
+                from uploads import handle_upload_action
+                
+                with span('store'):
+                    status_code, payload = handle_upload_action(cursor, user_id, body)
+                    if status_code == 202:
+                        maintain_index(cursor, user_id)
+                        bump_library_version(cursor, user_id)
+                    conn.commit()
                 cursor.close()
-                conn.close()
+                
+                if body['action'] == 'upload_finalize' and payload.get('status') == 'queued':
+                    embed_uploads_inline(conn, [payload['id']])
+                
                 return {
-                    'statusCode': 400,
+                    'statusCode': status_code,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({
-                        'error': 'File too large. Maximum size is 5MB.'
-                    }),
+                    'body': json.dumps(payload),
                     'isBase64Encoded': False
                 }
             
-            # Check documents limit (20 per account)
-            cursor.execute("""
-                SELECT COUNT(*) as count FROM documents WHERE user_id = %s
-            """, (user_id,))
-            doc_count = cursor.fetchone()['count']
-            
-            if doc_count >= 20:
+            # Batch mode: {"documents": [{name, content, file_type}, ...]}
+            if 'documents' in body:
+                items = body['documents']
+                if not isinstance(items, list) or not items or len(items) > MAX_BATCH_DOCUMENTS:
+                    cursor.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({
+                            'error': f'Batch must contain 1 to {MAX_BATCH_DOCUMENTS} documents.'
+                        }),
+                        'isBase64Encoded': False
+                    }
+                
+                with span('store'):
+                    results = ingest_documents(cursor, user_id, [
+                        item if isinstance(item, dict) else {} for item in items
+                    ])
+                    created = sum(1 for result in results if result['status'] == 'created')
+                    queued = sum(1 for result in results if result['status'] == 'queued')
+                    if created:
+                        maintain_index(cursor, user_id)
+                        bump_library_version(cursor, user_id)
+                    conn.commit()
+                
+                if INFO:
+                    print(f"[INFO] Batch upload stored {created + queued} of {len(results)} documents for user {user_id}")
+                
                 cursor.close()
-                conn.close()
+                embed_uploads_inline(conn, [result['id'] for result in results if result['status'] == 'queued'])
+                
+                # 207 Multi-Status when only part of the batch was stored
+                if created + queued == len(results):
+                    status_code = 202
+                else:
+                    status_code = 207 if created + queued else 400
                 return {
-                    'statusCode': 400,
+                    'statusCode': status_code,
                     'headers': {
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
                     'body': json.dumps({
-                        'error': 'Document limit reached. Maximum 20 documents per account.'
+                        'results': results,
+                        'created': created,
+                        'queued': queued,
+                        'failed': len(results) - created - queued
                     }),
                     'isBase64Encoded': False
                 }
             
-            # Process content for embedding (only text files now)
-            text_for_embedding = content
-            content_to_save = content  # Store original content
+            with span('store'):
+                result = ingest_documents(cursor, user_id, [{
+                    'name': body.get('name', 'Untitled'),
+                    'content': body.get('content', ''),
+                    'file_type': body.get('file_type', 'text/plain')
+                }])[0]
             
-            # Create embedding from text
-            embedding = create_embedding(text_for_embedding)
-            
-            # Only save if we have embedding (no point storing without search capability)
-            if not embedding:
+            if result['status'] == 'error':
                 cursor.close()
-                conn.close()
                 return {
                     'statusCode': 400,
                     'headers': {
@@ -290,35 +393,28 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'Access-Control-Allow-Origin': '*'
                     },
                     'body': json.dumps({
-                        'error': 'Failed to create embedding. Please check if OpenAI API key is configured.'
+                        'error': result['error']
                     }),
                     'isBase64Encoded': False
                 }
             
-            # Insert document with full content and embedding
-            cursor.execute("""
-                INSERT INTO documents (name, content, file_type, embedding, created_at, user_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (
-                name,
-                content_to_save,  # Store full content
-                file_type,
-                json.dumps(embedding),
-                datetime.now(),
-                user_id
-            ))
+            doc_id = result['id']
+            with span('store'):
+                if result['status'] == 'created':
+                    maintain_index(cursor, user_id)
+                    bump_library_version(cursor, user_id)
+                conn.commit()
             
-            doc_id = cursor.fetchone()['id']
-            conn.commit()
-            
-            print(f"[INFO] Document {doc_id} created for user {user_id}")
+            if INFO:
+                print(f"[INFO] Document {doc_id} {result['status']} for user {user_id}")
             
             cursor.close()
-            conn.close()
+            if result['status'] == 'queued':
+                embed_uploads_inline(conn, [doc_id])
             
+            # Embedding happens in the ingest worker, identical content is ready at once
             return {
-                'statusCode': 201,
+                'statusCode': 202,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
@@ -326,16 +422,18 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({
                     'id': doc_id,
                     'message': 'Document uploaded successfully',
-                    'has_embedding': embedding is not None
+                    'status': result['status'],
+                    'has_embedding': result['status'] == 'created',
+                    'chunks': result['chunks'],
+                    'deduplicated': result['deduplicated']
                 }),
                 'isBase64Encoded': False
             }
             
         elif method == 'DELETE':
-            # Delete document
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            from ann import bump_library_version, maintain_index
             
+            # Delete document
             query_params = event.get('queryStringParameters', {}) or {}
             doc_id = query_params.get('id')
             
@@ -359,7 +457,6 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             deleted = cursor.fetchone()
             if not deleted:
                 cursor.close()
-                conn.close()
                 return {
                     'statusCode': 404,
                     'headers': {
@@ -370,9 +467,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            maintain_index(cursor, user_id)
+            bump_library_version(cursor, user_id)
             conn.commit()
             cursor.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -411,4 +509,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'detail': str(e)
             }),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
@@ -0,0 +1,274 @@
+import hashlib
+import os
+import secrets
+import psycopg2.extras
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterator, List, Tuple
+from chunking import split_streaming
+from compression import compress_pieces
+from timing import INFO
+from ingest import (
+    EMBEDDING_MODEL_ID, MAX_DOCUMENTS_PER_USER, PREVIEW_CHARS,
+    copy_chunks, enqueue_jobs, find_duplicates, is_text_file, make_preview
+)
+
+# Characters per part keep every request small, the whole file may be much larger
+MAX_PART_SIZE = int(os.getenv('MAX_PART_SIZE', str(1024 * 1024)))
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', str(50 * 1024 * 1024)))
+# Unfinished uploads of a user are removed when they start a new one after this
+UPLOAD_TTL_HOURS = int(os.getenv('UPLOAD_TTL_HOURS', '24'))
+
+def upload_state(session: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'upload_id': session['id'],
+        'next_part': session['next_part'],
+        'received': session['received_chars'],
+        'chunks': session['chunk_count']
+    }
+
+def lock_session(cursor, user_id: int, upload_id: Any) -> Dict[str, Any]:
+    """Lock user's upload session, parts of one upload are applied one at a time"""
+    cursor.execute("""
+        SELECT id, document_id, next_part, received_chars, chunk_count, carry
+        FROM upload_sessions
+        WHERE id = %s AND user_id = %s AND expires_at > %s
+        FOR UPDATE
+    """, (str(upload_id), user_id, datetime.now()))
+    return cursor.fetchone()
+
+def insert_chunks(cursor, document_id: int, first_index: int, chunks: List[str]) -> None:
+    """Chunk rows of an upload, without an owner until finalize"""
+    if not chunks:
+        return
+    psycopg2.extras.execute_values(cursor, """
+        INSERT INTO document_chunks (document_id, user_id, chunk_index, content)
+        VALUES %s
+    """, [(document_id, None, first_index + i, chunk) for i, chunk in enumerate(chunks)], page_size=500)
+
+def store_chunks(cursor, document_id: int, first_index: int, chunks: List[str]) -> None:
+    """Insert chunk rows and queue the document for embedding unless a job is already waiting"""
+    if not chunks:
+        return
+    insert_chunks(cursor, document_id, first_index, chunks)
+    cursor.execute("""
+        INSERT INTO ingest_jobs (document_id)
+        SELECT %s WHERE NOT EXISTS (
+            SELECT 1 FROM ingest_jobs WHERE document_id = %s AND status = 'pending'
+        )
+    """, (document_id, document_id))
+
+def read_parts(cursor, upload_id: str) -> Iterator[str]:
+    """Parts of an upload in order, only one of them in memory at a time"""
+    cursor.execute("""
+        SELECT part_number FROM upload_parts WHERE upload_id = %s ORDER BY part_number
+    """, (upload_id,))
+    for number in [row['part_number'] for row in cursor.fetchall()]:
+        cursor.execute("""
+            SELECT content FROM upload_parts WHERE upload_id = %s AND part_number = %s
+        """, (upload_id, number))
+        yield cursor.fetchone()['content']
+
+def store_content(cursor, session: Dict[str, Any]) -> str:
+    """
+    Write the joined parts into the upload's document row
+    Returns: content hash, matches content_hash in ingest.py
+    """
+    digest = hashlib.sha256()
+    head = []
+    head_chars = 0
+
+    def pieces() -> Iterator[str]:
+        nonlocal head_chars
+        for part in read_parts(cursor, session['id']):
+            digest.update(part.encode('utf-8'))
+            if head_chars <= PREVIEW_CHARS:
+                head.append(part[:PREVIEW_CHARS + 1 - head_chars])
+                head_chars += len(head[-1])
+            yield part
+
+    # Compressed part by part like encode_content would, the whole file is never held
+    compressed, codec = compress_pieces(pieces())
+    preview = make_preview(''.join(head))
+    if compressed is not None:
+        cursor.execute("""
+            UPDATE documents
+            SET content = NULL, content_compressed = %s, content_codec = %s, preview = %s, content_hash = %s
+            WHERE id = %s
+        """, (compressed, codec, preview, digest.hexdigest(), session['document_id']))
+    else:
+        # Short or incompressible text stays plain, joined inside the database
+        cursor.execute("""
+            UPDATE documents d
+            SET content = parts.content, preview = %s, content_hash = %s
+            FROM (
+                SELECT string_agg(content, '' ORDER BY part_number) AS content
+                FROM upload_parts WHERE upload_id = %s
+            ) AS parts
+            WHERE d.id = %s
+        """, (preview, digest.hexdigest(), session['id'], session['document_id']))
+    return digest.hexdigest()
+
+def init_upload(cursor, user_id: int, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    name = body.get('name', 'Untitled')
+    file_type = body.get('file_type', 'text/plain')
+    if not isinstance(name, str):
+        return 400, {'error': 'Document name must be a string.'}
+    if not is_text_file(name, file_type):
+        return 400, {'error': 'Only text files (.txt) are supported.'}
+
+    # Abandoned uploads take their hidden document and chunks with them
+    now = datetime.now()
+    cursor.execute("""
+        DELETE FROM documents WHERE id IN (
+            SELECT document_id FROM upload_sessions WHERE user_id = %s AND expires_at <= %s
+        )
+    """, (user_id, now))
+
+    cursor.execute("""
+        SELECT (SELECT COUNT(*) FROM documents WHERE user_id = %s)
+             + (SELECT COUNT(*) FROM upload_sessions WHERE user_id = %s) AS count
+    """, (user_id, user_id))
+    if cursor.fetchone()['count'] >= MAX_DOCUMENTS_PER_USER:
+        return 400, {'error': f'Document limit reached. Maximum {MAX_DOCUMENTS_PER_USER} documents per account.'}
+
+    # No owner until finalize, so listings and chat search skip the document
+    cursor.execute("""
+        INSERT INTO documents (name, content, preview, file_type, created_at, user_id)
+        VALUES (%s, '', '', %s, %s, NULL)
+        RETURNING id
+    """, (name, file_type, now))
+    document_id = cursor.fetchone()['id']
+
+    upload_id = secrets.token_hex(16)
+    cursor.execute("""
+        INSERT INTO upload_sessions (id, user_id, document_id, created_at, expires_at)
+        VALUES (%s, %s, %s, %s, %s)
+        RETURNING id, next_part, received_chars, chunk_count
+    """, (upload_id, user_id, document_id, now, now + timedelta(hours=UPLOAD_TTL_HOURS)))
+    session = cursor.fetchone()
+
+    if INFO:
+        print(f"[INFO] Upload {upload_id} started for user {user_id}, document {document_id}")
+    return 200, dict(upload_state(session), max_part_size=MAX_PART_SIZE, max_upload_size=MAX_UPLOAD_SIZE)
+
+def append_part(cursor, user_id: int, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    content = body.get('content')
+    part_number = body.get('part_number')
+    if not isinstance(content, str) or not isinstance(part_number, int):
+        return 400, {'error': 'Part needs content string and part_number.'}
+    if len(content) > MAX_PART_SIZE:
+        return 413, {'error': f'Part too large. Maximum {MAX_PART_SIZE} characters per part.'}
+
+    session = lock_session(cursor, user_id, body.get('upload_id'))
+    if session is None:
+        return 404, {'error': 'Upload not found or expired'}
+
+    # A part resent after a lost response is acknowledged, not stored twice
+    if part_number < session['next_part']:
+        return 200, upload_state(session)
+    if part_number > session['next_part']:
+        return 409, dict(upload_state(session), error=f"Expected part {session['next_part']}")
+    if session['received_chars'] + len(content) > MAX_UPLOAD_SIZE:
+        return 413, {'error': f'File too large. Maximum {MAX_UPLOAD_SIZE} characters per upload.'}
+
+    cursor.execute("""
+        INSERT INTO upload_parts (upload_id, part_number, content) VALUES (%s, %s, %s)
+    """, (session['id'], part_number, content))
+
+    # Chunks complete with this part are embedded by the worker while later parts arrive
+    chunks, carry = split_streaming(session['carry'] + content, final=False)
+    store_chunks(cursor, session['document_id'], session['chunk_count'], chunks)
+
+    cursor.execute("""
+        UPDATE upload_sessions
+        SET next_part = next_part + 1, received_chars = received_chars + %s,
+            chunk_count = chunk_count + %s, carry = %s
+        WHERE id = %s
+        RETURNING id, next_part, received_chars, chunk_count
+    """, (len(content), len(chunks), carry, session['id']))
+    return 200, upload_state(cursor.fetchone())
+
+def upload_status(cursor, user_id: int, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    cursor.execute("""
+        SELECT id, next_part, received_chars, chunk_count
+        FROM upload_sessions
+        WHERE id = %s AND user_id = %s AND expires_at > %s
+    """, (str(body.get('upload_id')), user_id, datetime.now()))
+    session = cursor.fetchone()
+    if session is None:
+        return 404, {'error': 'Upload not found or expired'}
+    return 200, upload_state(session)
+
+def finalize_upload(cursor, user_id: int, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    session = lock_session(cursor, user_id, body.get('upload_id'))
+    if session is None:
+        return 404, {'error': 'Upload not found or expired'}
+
+    chunks, _ = split_streaming(session['carry'], final=True)
+    if session['chunk_count'] + len(chunks) == 0:
+        return 400, {'error': 'Document has no text content.'}
+    insert_chunks(cursor, session['document_id'], session['chunk_count'], chunks)
+
+    document_id = session['document_id']
+    digest = store_content(cursor, session)
+    cursor.execute("""
+        UPDATE documents SET user_id = %s, created_at = %s WHERE id = %s
+    """, (user_id, datetime.now(), document_id))
+    cursor.execute("DELETE FROM upload_sessions WHERE id = %s", (session['id'],))
+
+    # Content already embedded elsewhere replaces the chunks embedded so far, as in ingest_documents
+    source = find_duplicates(cursor, [digest]).get(digest)
+    if source is not None:
+        cursor.execute("DELETE FROM document_chunks WHERE document_id = %s", (document_id,))
+        cursor.execute("""
+            DELETE FROM ingest_jobs WHERE document_id = %s AND status = 'pending'
+        """, (document_id,))
+        copy_chunks(cursor, user_id, [(document_id, source['id'])])
+        cursor.execute("""
+            UPDATE documents SET embedding = %s, embedding_model = %s WHERE id = %s
+        """, (source['embedding'], EMBEDDING_MODEL_ID, document_id))
+        if INFO:
+            print(f"[INFO] Upload {session['id']} finalized as document {document_id}, copied from {source['id']}")
+        return 202, {
+            'id': document_id,
+            'message': 'Document uploaded successfully',
+            'status': 'created',
+            'has_embedding': True,
+            'chunks': source['chunk_count'],
+            'deduplicated': True
+        }
+
+    cursor.execute("""
+        UPDATE document_chunks SET user_id = %s WHERE document_id = %s
+    """, (user_id, document_id))
+    # Always a new job: one claimed before finalize may still see the document
+    # without an owner and leave its vector unset
+    enqueue_jobs(cursor, [document_id])
+
+    total_chunks = session['chunk_count'] + len(chunks)
+    if INFO:
+        print(f"[INFO] Upload {session['id']} finalized as document {document_id}, {total_chunks} chunks")
+    return 202, {
+        'id': document_id,
+        'message': 'Document uploaded successfully',
+        'status': 'queued',
+        'has_embedding': False,
+        'chunks': total_chunks,
+        'deduplicated': False
+    }
+
+def handle_upload_action(cursor, user_id: int, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """
+    Business: One step of a resumable chunked upload
+    Args: cursor - DictCursor inside the caller's transaction
+          user_id - owner of the upload
+          body - request body with action, upload_id and the step's fields
+    Returns: HTTP status code and response payload
+    """
+    steps = {
+        'upload_init': init_upload,
+        'upload_part': append_part,
+        'upload_status': upload_status,
+        'upload_finalize': finalize_upload
+    }
+    return steps[body['action']](cursor, user_id, body)
@@ -0,0 +1,130 @@
+import os
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Embeddings are stored as packed little-endian float32, L2-normalized on write
+EMBEDDING_DTYPE = np.dtype('<f4')
+
+# Compact code stored next to every chunk vector and scored before the exact
+# re-rank: int8 (4x smaller than float32), binary (32x) or none to score floats
+EMBEDDING_CODE = os.getenv('EMBEDDING_CODE', 'int8')
+# First byte of a code names its kind, codes written under another setting are recognised
+CODE_HEADERS = {'int8': 1, 'binary': 2}
+# Rows dequantized at once while scoring int8 codes, small blocks stay in CPU cache
+CODE_SCORE_BLOCK = 256
+# Set bits of every byte value, Hamming distances of binary codes are table lookups
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint16)
+
+def normalize_embedding(values: Sequence[float]) -> np.ndarray:
+    """Return embedding as a unit-length float32 vector"""
+    vector = np.asarray(values, dtype=EMBEDDING_DTYPE)
+    norm = float(np.linalg.norm(vector))
+    if norm > 0:
+        vector = vector / norm
+    return vector.astype(EMBEDDING_DTYPE, copy=False)
+
+def pack_embedding(values: Sequence[float]) -> bytes:
+    """Pack embedding as little-endian float32 bytes for BYTEA storage"""
+    return np.asarray(values, dtype=EMBEDDING_DTYPE).tobytes()
+
+def unpack_embedding(data) -> np.ndarray:
+    """Decode packed float32 embedding as a zero-copy view over the buffer"""
+    return np.frombuffer(data, dtype=EMBEDDING_DTYPE)
+
+def stack_embeddings(blobs: Sequence, dim: int) -> Tuple[np.ndarray, List[int]]:
+    """
+    Stack packed embeddings into one contiguous (n, dim) matrix
+    Returns the matrix and the input positions of the rows kept,
+    rows with a different dimension are skipped
+    """
+    positions = [i for i, blob in enumerate(blobs) if len(blob) == dim * EMBEDDING_DTYPE.itemsize]
+    matrix = np.empty((len(positions), dim), dtype=EMBEDDING_DTYPE)
+    for row, position in enumerate(positions):
+        matrix[row] = unpack_embedding(blobs[position])
+    return matrix, positions
+
+def top_k(matrix: np.ndarray, query: np.ndarray, k: int, min_score: float = -1.0) -> List[Tuple[int, float]]:
+    """
+    Score all rows against a unit query with one matrix-vector product
+    Returns up to k (row, cosine similarity) pairs, best first
+    """
+    if matrix.shape[0] == 0 or k <= 0:
+        return []
+    return top_scores(matrix @ query, k, min_score)
+
+def top_scores(scores: np.ndarray, k: int, min_score: float = -1.0) -> List[Tuple[int, float]]:
+    """Up to k (row, score) pairs of a score vector, best first"""
+    if scores.shape[0] == 0 or k <= 0:
+        return []
+
+    if scores.shape[0] > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    return [(int(row), float(scores[row])) for row in candidates if scores[row] > min_score]
+
+def encode_code(vector: np.ndarray, kind: str = EMBEDDING_CODE) -> Optional[bytes]:
+    """
+    Compact code of a unit vector, None when kind is none
+    int8 keeps a float32 scale and one byte per dimension, binary one sign bit per dimension
+    """
+    if kind == 'int8':
+        scale = float(np.max(np.abs(vector))) / 127 or 1.0
+        codes = np.clip(np.round(vector / scale), -127, 127).astype(np.int8)
+        return bytes([CODE_HEADERS['int8']]) + np.float32(scale).tobytes() + codes.tobytes()
+    if kind == 'binary':
+        return bytes([CODE_HEADERS['binary']]) + np.packbits(vector > 0).tobytes()
+    return None
+
+def code_size(kind: str, dim: int) -> int:
+    """Bytes of one code of a dim-dimensional vector, header included"""
+    if kind == 'int8':
+        return 1 + EMBEDDING_DTYPE.itemsize + dim
+    if kind == 'binary':
+        return 1 + (dim + 7) // 8
+    return dim * EMBEDDING_DTYPE.itemsize
+
+def stack_codes(blobs: Sequence, kind: str, dim: int) -> Tuple[Dict[str, Any], List[int]]:
+    """
+    Stack codes of one kind into a contiguous matrix for scoring
+    kind none stacks packed float32 vectors instead
+    Returns the codes and the input positions of the rows kept,
+    rows of another kind or dimension are skipped
+    """
+    if kind not in CODE_HEADERS:
+        matrix, positions = stack_embeddings(blobs, dim)
+        return {'kind': 'none', 'dim': dim, 'matrix': matrix}, positions
+
+    size = code_size(kind, dim)
+    # psycopg2 returns BYTEA as memoryview, whose items are one-byte strings
+    header = bytes([CODE_HEADERS[kind]])
+    positions = [i for i, blob in enumerate(blobs) if len(blob) == size and bytes(blob[:1]) == header]
+    raw = np.frombuffer(b''.join(bytes(blobs[p]) for p in positions), dtype=np.uint8).reshape(len(positions), size)
+    if kind == 'int8':
+        scales = raw[:, 1:1 + EMBEDDING_DTYPE.itemsize].copy().view(EMBEDDING_DTYPE).ravel()
+        matrix = raw[:, 1 + EMBEDDING_DTYPE.itemsize:].copy().view(np.int8)
+        return {'kind': kind, 'dim': dim, 'matrix': matrix, 'scales': scales}, positions
+    return {'kind': kind, 'dim': dim, 'matrix': raw[:, 1:].copy()}, positions
+
+def codes_bytes(codes: Dict[str, Any]) -> int:
+    """Memory held by stacked codes"""
+    return codes['matrix'].nbytes + (codes['scales'].nbytes if 'scales' in codes else 0)
+
+def score_codes(codes: Dict[str, Any], query: np.ndarray) -> np.ndarray:
+    """
+    Approximate cosine similarity of every stacked code with a unit query
+    Binary codes estimate the angle from the Hamming distance of the sign bits
+    """
+    matrix = codes['matrix']
+    if codes['kind'] == 'int8':
+        scores = np.empty(matrix.shape[0], dtype=EMBEDDING_DTYPE)
+        for start in range(0, matrix.shape[0], CODE_SCORE_BLOCK):
+            block = matrix[start:start + CODE_SCORE_BLOCK]
+            scores[start:start + block.shape[0]] = block.astype(EMBEDDING_DTYPE) @ query
+        return scores * codes['scales']
+    if codes['kind'] == 'binary':
+        distances = POPCOUNT[matrix ^ np.packbits(query > 0)].sum(axis=1)
+        return np.cos(np.pi * distances / codes['dim']).astype(EMBEDDING_DTYPE)
+    return matrix @ query
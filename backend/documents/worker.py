@@ -0,0 +1,228 @@
+import os
+import random
+import time
+import psycopg2.extras
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Set
+from vectors import encode_code, normalize_embedding, pack_embedding, unpack_embedding
+from chunking import split_into_chunks
+from compression import row_content
+from ingest import (
+    EMBEDDING_DEADLINE, EMBEDDING_MODEL_ID, copy_chunks, content_hash, document_embedding,
+    embed_texts, find_duplicates, plan_batches
+)
+from db import get_db_connection, release_db_connection
+from ann import bump_library_version, maintain_index
+
+# Jobs claimed per transaction and wall time one worker invocation may use
+WORKER_BATCH_SIZE = int(os.getenv('WORKER_BATCH_SIZE', '20'))
+WORKER_TIME_BUDGET = float(os.getenv('WORKER_TIME_BUDGET', '25'))
+# Chunks embedded per batch, so one large document is spread over several
+# transactions, each a few embeddings requests long
+WORKER_MAX_CHUNKS = int(os.getenv('WORKER_MAX_CHUNKS', '2048'))
+
+# Exponential backoff with jitter between attempts, then the job is marked failed
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+
+def retry_delay(attempts: int) -> timedelta:
+    """Backoff before the next attempt, full jitter over the exponential step"""
+    step = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return timedelta(seconds=random.uniform(step / 2, step))
+
+def claim_jobs(cursor, limit: int, document_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """Lock due jobs, of the given documents only if any, concurrent workers skip rows locked by each other"""
+    cursor.execute("""
+        SELECT j.id, j.document_id, j.attempts, d.user_id, d.content, d.content_compressed, d.content_codec
+        FROM ingest_jobs j
+        JOIN documents d ON d.id = j.document_id
+        WHERE j.status = 'pending' AND j.next_attempt_at <= %s
+          AND (%s::int[] IS NULL OR j.document_id = ANY(%s::int[]))
+        ORDER BY j.next_attempt_at
+        LIMIT %s
+        FOR UPDATE OF j SKIP LOCKED
+    """, (datetime.now(), document_ids, document_ids, limit))
+    return cursor.fetchall()
+
+def chunk_documents(cursor, jobs: List[Dict[str, Any]]) -> None:
+    """Create chunk rows for claimed documents that have none yet"""
+    document_ids = [job['document_id'] for job in jobs]
+    cursor.execute("""
+        SELECT DISTINCT document_id FROM document_chunks WHERE document_id = ANY(%s)
+    """, (document_ids,))
+    chunked = {row['document_id'] for row in cursor.fetchall()}
+    unchunked = [job for job in jobs if job['document_id'] not in chunked]
+    if not unchunked:
+        return
+
+    # Content embedded since the upload (e.g. earlier in the queue) is copied, not re-embedded
+    texts = {job['document_id']: row_content(job) for job in unchunked}
+    digests = {document_id: content_hash(text) for document_id, text in texts.items()}
+    sources = find_duplicates(cursor, sorted(set(digests.values())))
+
+    rows = []
+    for job in unchunked:
+        source = sources.get(digests[job['document_id']])
+        if source is not None:
+            copy_chunks(cursor, job['user_id'], [(job['document_id'], source['id'])])
+            continue
+        rows.extend(
+            (job['document_id'], job['user_id'], chunk_index, chunk)
+            for chunk_index, chunk in enumerate(split_into_chunks(texts[job['document_id']]))
+        )
+
+    if rows:
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO document_chunks (document_id, user_id, chunk_index, content)
+            VALUES %s
+        """, rows, page_size=500)
+
+def embed_pending_chunks(cursor, document_ids: List[int], max_chunks: int = WORKER_MAX_CHUNKS,
+                         deadline: Optional[float] = None) -> Set[int]:
+    """
+    Embed up to max_chunks chunks of the given documents that have no vector yet
+    No embeddings request starts after deadline (time.monotonic()) or runs past it,
+    chunks not sent are left for the next batch
+    Returns: documents with a chunk whose embedding request failed
+    """
+    cursor.execute("""
+        SELECT id, document_id, content FROM document_chunks
+        WHERE document_id = ANY(%s) AND embedding IS NULL
+        ORDER BY chunk_index, document_id  -- small documents are not held back by a large one
+        LIMIT %s
+    """, (document_ids, max_chunks))
+    pending = cursor.fetchall()
+    if not pending:
+        return set()
+
+    # Identical chunk texts share one embedding input
+    texts = list(dict.fromkeys(row['content'] for row in pending))
+    sent = []
+    vectors = {}
+    for start, end in plan_batches(texts):
+        seconds = EMBEDDING_DEADLINE if deadline is None else min(EMBEDDING_DEADLINE, deadline - time.monotonic())
+        if seconds <= 0:
+            break
+        sent.extend(texts[start:end])
+        vectors.update(
+            (text, normalize_embedding(embedding))
+            for text, embedding in zip(texts[start:end], embed_texts(texts[start:end], seconds))
+            if embedding is not None
+        )
+
+    # The compact code chat scores first is written next to the float32 vector
+    updates = [
+        (row['id'], pack_embedding(vectors[row['content']]), encode_code(vectors[row['content']]))
+        for row in pending
+        if row['content'] in vectors
+    ]
+    if updates:
+        psycopg2.extras.execute_values(cursor, """
+            UPDATE document_chunks SET embedding = v.embedding, embedding_code = v.embedding_code
+            FROM (VALUES %s) AS v(id, embedding, embedding_code)
+            WHERE document_chunks.id = v.id
+        """, updates, template='(%s, %s::bytea, %s::bytea)', page_size=500)
+    sent = set(sent)
+    return {row['document_id'] for row in pending if row['content'] in sent and row['content'] not in vectors}
+
+def finish_jobs(cursor, jobs: List[Dict[str, Any]], failed: Set[int]) -> Dict[str, int]:
+    """
+    Complete documents whose chunks are all embedded, reschedule the rest
+    Documents left unfinished only by the per-batch chunk cap stay due without using an attempt
+    """
+    cursor.execute("""
+        SELECT document_id, array_agg(embedding ORDER BY chunk_index) AS embeddings,
+               bool_and(embedding IS NOT NULL) AS complete
+        FROM document_chunks
+        WHERE document_id = ANY(%s)
+        GROUP BY document_id
+    """, ([job['document_id'] for job in jobs],))
+    chunks = {row['document_id']: row for row in cursor.fetchall()}
+
+    counts = {'done': 0, 'continued': 0, 'retried': 0, 'failed': 0}
+    users = set()
+    now = datetime.now()
+    for job in jobs:
+        row = chunks.get(job['document_id'])
+        if row is not None and row['complete']:
+            # An unfinished chunked upload has no owner and more chunks to come,
+            # finalize queues another job that sets its vector
+            vectors = [unpack_embedding(embedding) for embedding in row['embeddings']]
+            cursor.execute("""
+                UPDATE documents SET embedding = %s, embedding_model = %s WHERE id = %s AND user_id IS NOT NULL
+            """, (document_embedding(vectors), EMBEDDING_MODEL_ID, job['document_id']))
+            cursor.execute("DELETE FROM ingest_jobs WHERE id = %s", (job['id'],))
+            # Chunked uploads have no owner until finalize, which maintains the index itself
+            if job['user_id'] is not None:
+                users.add(job['user_id'])
+            counts['done'] += 1
+            continue
+
+        if row is not None and job['document_id'] not in failed:
+            cursor.execute("""
+                UPDATE ingest_jobs SET next_attempt_at = %s, updated_at = %s WHERE id = %s
+            """, (now, now, job['id']))
+            counts['continued'] += 1
+            continue
+
+        attempts = job['attempts'] + 1
+        error = 'Document has no text to embed' if row is None else 'Embedding request failed'
+        if row is None or attempts >= MAX_ATTEMPTS:
+            cursor.execute("""
+                UPDATE ingest_jobs SET status = 'failed', attempts = %s, last_error = %s, updated_at = %s
+                WHERE id = %s
+            """, (attempts, error, now, job['id']))
+            counts['failed'] += 1
+        else:
+            cursor.execute("""
+                UPDATE ingest_jobs SET attempts = %s, last_error = %s, next_attempt_at = %s, updated_at = %s
+                WHERE id = %s
+            """, (attempts, error, now + retry_delay(attempts), now, job['id']))
+            counts['retried'] += 1
+
+    for user_id in users:
+        maintain_index(cursor, user_id)
+        bump_library_version(cursor, user_id)
+    return counts
+
+def process_batch(conn, batch_size: int = WORKER_BATCH_SIZE, document_ids: Optional[List[int]] = None,
+                  max_chunks: int = WORKER_MAX_CHUNKS, deadline: Optional[float] = None) -> Dict[str, int]:
+    """Claim, embed and complete one batch of jobs in a single transaction, see embed_pending_chunks"""
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    try:
+        jobs = claim_jobs(cursor, batch_size, document_ids)
+        if not jobs:
+            conn.rollback()
+            return {'done': 0, 'continued': 0, 'retried': 0, 'failed': 0}
+
+        chunk_documents(cursor, jobs)
+        failed = embed_pending_chunks(cursor, [job['document_id'] for job in jobs], max_chunks, deadline)
+        counts = finish_jobs(cursor, jobs, failed)
+        conn.commit()
+        return counts
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def drain_queue(conn, budget: float, batch_size: int = WORKER_BATCH_SIZE) -> Dict[str, int]:
+    """Process batches until the queue is empty or budget seconds have passed, requests included"""
+    deadline = time.monotonic() + budget
+    totals = {'done': 0, 'continued': 0, 'retried': 0, 'failed': 0}
+    while time.monotonic() < deadline:
+        counts = process_batch(conn, batch_size, deadline=deadline)
+        if not any(counts.values()):
+            break
+        for key, value in counts.items():
+            totals[key] += value
+    return totals
+
+if __name__ == '__main__':
+    # Manual run, deployments drain the queue through backend/ingest on a timer
+    conn = get_db_connection()
+    try:
+        print(f"[INFO] Ingest worker finished: {drain_queue(conn, WORKER_TIME_BUDGET)}")
+    finally:
+        release_db_connection(conn)
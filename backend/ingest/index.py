@@ -0,0 +1,25 @@
+import json
+from typing import Dict, Any
+from db import get_db_connection, release_db_connection
+from worker import WORKER_TIME_BUDGET, drain_queue
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Business: Background chunking and embedding of queued document uploads, run on a timer
+    Args: event - timer trigger event
+          context - function context
+    Returns: HTTP response with processed job counts
+    """
+    conn = get_db_connection()
+    try:
+        totals = drain_queue(conn, WORKER_TIME_BUDGET)
+    finally:
+        release_db_connection(conn)
+
+    print(f"[INFO] Ingest worker finished: {totals}")
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(totals),
+        'isBase64Encoded': False
+    }
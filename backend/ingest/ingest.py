@@ -0,0 +1,238 @@
+import hashlib
+import os
+import psycopg2.extras
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from vectors import normalize_embedding, pack_embedding
+from upstream import openai_post
+from compression import encode_content
+from timing import INFO
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Requested embedding size, must match the chat function; 0 keeps the model's 1536
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', '0'))
+# Recorded in documents.embedding_model, so deduplication never copies vectors of another size
+EMBEDDING_MODEL_ID = f"{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}" if EMBEDDING_DIMENSIONS else EMBEDDING_MODEL
+
+# Provider limits per embeddings request are 2048 inputs and 300k tokens,
+# characters are capped assuming ~2 characters per token for non-Latin text
+EMBEDDING_MAX_INPUTS = int(os.getenv('EMBEDDING_MAX_INPUTS', '2048'))
+EMBEDDING_MAX_CHARS = int(os.getenv('EMBEDDING_MAX_CHARS', '400000'))
+MAX_INPUT_CHARS = 8000
+# Seconds one embeddings request may take, retries included
+EMBEDDING_DEADLINE = float(os.getenv('EMBEDDING_DEADLINE', '30'))
+
+MAX_FILE_SIZE = 5 * 1024 * 1024
+PREVIEW_CHARS = 200
+# Libraries past ANN_MIN_CHUNKS chunks are searched through an IVF index, see ann.py
+MAX_DOCUMENTS_PER_USER = int(os.getenv('MAX_DOCUMENTS_PER_USER', '1000'))
+
+def plan_batches(texts: List[str]) -> List[Tuple[int, int]]:
+    """Split texts into (start, end) ranges that fit one embeddings request"""
+    batches = []
+    start = 0
+    chars = 0
+    for position, text in enumerate(texts):
+        size = min(len(text), MAX_INPUT_CHARS)
+        if position > start and (position - start >= EMBEDDING_MAX_INPUTS or chars + size > EMBEDDING_MAX_CHARS):
+            batches.append((start, position))
+            start = position
+            chars = 0
+        chars += size
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+def embed_texts(texts: List[str], deadline: float = EMBEDDING_DEADLINE) -> List[Optional[List[float]]]:
+    """
+    Embed texts with array-input requests, None for texts whose request failed
+    deadline - seconds each request may take, retries included
+    """
+    embeddings: List[Optional[List[float]]] = [None] * len(texts)
+
+    openai_api_key = os.getenv('OPENAI_API_KEY')
+    if not openai_api_key:
+        if INFO:
+            print("[INFO] No OpenAI API key, skipping embedding")
+        return embeddings
+
+    for start, end in plan_batches(texts):
+        data = {
+            "model": EMBEDDING_MODEL,
+            "input": [text[:MAX_INPUT_CHARS] for text in texts[start:end]]  # Limit text length
+        }
+        if EMBEDDING_DIMENSIONS:
+            data["dimensions"] = EMBEDDING_DIMENSIONS
+
+        try:
+            response = openai_post("/embeddings", data, deadline=deadline)
+
+            if response.status_code != 200:
+                print(f"[ERROR] OpenAI API error: {response.status_code}")
+                continue
+
+            for item in response.json()['data']:
+                embeddings[start + item['index']] = item['embedding']
+        except Exception as e:
+            print(f"[ERROR] Failed to create embedding: {e}")
+
+    created = sum(1 for embedding in embeddings if embedding is not None)
+    if INFO:
+        print(f"[INFO] Created {created} of {len(texts)} embeddings")
+    return embeddings
+
+def document_embedding(vectors: List[Any]) -> bytes:
+    """Whole-document vector is the normalized mean of its chunk vectors"""
+    return pack_embedding(normalize_embedding(sum(vectors)))
+
+def make_preview(content: str) -> str:
+    """Listing preview, matches the SQL backfill in V0011"""
+    if len(content) > PREVIEW_CHARS:
+        return content[:PREVIEW_CHARS] + '...'
+    return content
+
+def content_hash(content: str) -> str:
+    """SHA-256 of document text, matches the SQL backfill in V0008"""
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def find_duplicates(cursor, digests: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Find documents with identical content whose chunks are all embedded, from any user"""
+    if not digests:
+        return {}
+    cursor.execute("""
+        SELECT DISTINCT ON (d.content_hash) d.content_hash, d.id, d.embedding,
+               (SELECT COUNT(*) FROM document_chunks c WHERE c.document_id = d.id) AS chunk_count
+        FROM documents d
+        WHERE d.content_hash = ANY(%s::bpchar[]) AND d.embedding_model = %s AND d.embedding IS NOT NULL
+          AND EXISTS (SELECT 1 FROM document_chunks c WHERE c.document_id = d.id)
+          AND NOT EXISTS (SELECT 1 FROM document_chunks c WHERE c.document_id = d.id AND c.embedding IS NULL)
+        ORDER BY d.content_hash, d.id
+    """, (digests, EMBEDDING_MODEL_ID))
+    return {row['content_hash']: row for row in cursor.fetchall()}
+
+def copy_chunks(cursor, user_id: int, pairs: List[Tuple[int, int]]) -> None:
+    """Reuse chunks, embeddings and codes for (document_id, source_id) pairs of identical content"""
+    if not pairs:
+        return
+    cursor.execute("""
+        INSERT INTO document_chunks (document_id, user_id, chunk_index, content, embedding, embedding_code)
+        SELECT pairs.document_id, %s, c.chunk_index, c.content, c.embedding, c.embedding_code
+        FROM unnest(%s::int[], %s::int[]) AS pairs(document_id, source_id)
+        JOIN document_chunks c ON c.document_id = pairs.source_id
+    """, (user_id, [pair[0] for pair in pairs], [pair[1] for pair in pairs]))
+
+def enqueue_jobs(cursor, document_ids: List[int]) -> None:
+    """Queue documents for chunking and embedding by the ingest worker"""
+    if not document_ids:
+        return
+    psycopg2.extras.execute_values(cursor, """
+        INSERT INTO ingest_jobs (document_id) VALUES %s
+    """, [(document_id,) for document_id in document_ids], page_size=len(document_ids))
+
+def is_text_file(name: str, file_type: Any) -> bool:
+    """Only text files are accepted"""
+    return file_type == 'text/plain' or name.endswith('.txt')
+
+def validate_document(item: Dict[str, Any]) -> Optional[str]:
+    """Check one upload, returns error message or None"""
+    name = item.get('name', 'Untitled')
+    content = item.get('content', '')
+    file_type = item.get('file_type', 'text/plain')
+
+    if not isinstance(name, str) or not isinstance(content, str):
+        return 'Document name and content must be strings.'
+
+    # Only accept text files
+    if not is_text_file(name, file_type):
+        return 'Only text files (.txt) are supported.'
+
+    if not content.strip():
+        return 'Document has no text content.'
+
+    # Check file size limit (5MB)
+    if len(content) > MAX_FILE_SIZE:
+        return 'File too large. Maximum size is 5MB.'
+
+    return None
+
+def ingest_documents(cursor, user_id: int, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Validate and insert uploaded documents in bulk, queueing them for embedding
+    Args: cursor - DictCursor inside the caller's transaction
+          user_id - owner of the documents
+          items - dicts with name, content and file_type
+    Returns: per-item status dicts in input order, status is created, queued or error
+    """
+    results = [{'index': i, 'name': item.get('name', 'Untitled')} for i, item in enumerate(items)]
+
+    accepted = []
+    for i, item in enumerate(items):
+        error = validate_document(item)
+        if error:
+            results[i].update({'status': 'error', 'error': error})
+        else:
+            accepted.append(i)
+
+    # Check documents limit per account once for the whole batch
+    cursor.execute("""
+        SELECT COUNT(*) as count FROM documents WHERE user_id = %s
+    """, (user_id,))
+    slots = max(0, MAX_DOCUMENTS_PER_USER - cursor.fetchone()['count'])
+    for i in accepted[slots:]:
+        results[i].update({
+            'status': 'error',
+            'error': f'Document limit reached. Maximum {MAX_DOCUMENTS_PER_USER} documents per account.'
+        })
+    accepted = accepted[:slots]
+
+    # Identical content uploaded before reuses its chunks and embeddings right away,
+    # everything else is stored without embeddings and queued for the worker
+    if not accepted:
+        return results
+    digests = {i: content_hash(items[i].get('content', '')) for i in accepted}
+    sources = find_duplicates(cursor, sorted(set(digests.values())))
+
+    # Ids are reserved up front so chunks and jobs can reference them in bulk inserts
+    cursor.execute("""
+        SELECT nextval(pg_get_serial_sequence('documents', 'id')) AS id
+        FROM generate_series(1, %s)
+    """, (len(accepted),))
+    doc_ids = dict(zip(accepted, [row['id'] for row in cursor.fetchall()]))
+
+    now = datetime.now()
+    document_rows = []
+    copies = []
+    queued = []
+    for i in accepted:
+        item = items[i]
+        source = sources.get(digests[i])
+        if source is not None:
+            copies.append((doc_ids[i], source['id']))
+            results[i].update({'status': 'created', 'id': doc_ids[i], 'chunks': source['chunk_count'], 'deduplicated': True})
+        else:
+            queued.append(doc_ids[i])
+            results[i].update({'status': 'queued', 'id': doc_ids[i], 'chunks': 0, 'deduplicated': False})
+
+        document_rows.append((
+            doc_ids[i],
+            item.get('name', 'Untitled'),
+            *encode_content(item.get('content', '')),  # Full content, compressed past COMPRESSION_MIN_BYTES
+            make_preview(item.get('content', '')),
+            item.get('file_type', 'text/plain'),
+            digests[i],
+            EMBEDDING_MODEL_ID if source is not None else None,
+            source['embedding'] if source is not None else None,
+            now,
+            user_id
+        ))
+
+    psycopg2.extras.execute_values(cursor, """
+        INSERT INTO documents (id, name, content, content_compressed, content_codec, preview, file_type,
+                               content_hash, embedding_model, embedding, created_at, user_id)
+        VALUES %s
+    """, document_rows, page_size=len(document_rows))
+
+    copy_chunks(cursor, user_id, copies)
+    enqueue_jobs(cursor, queued)
+
+    return results
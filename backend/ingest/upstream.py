@@ -0,0 +1,111 @@
+import os
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional
+from timing import INFO
+
+# requests is imported on the first provider call, paths that never
+# call the API (CORS preflight, rejected requests) skip its import cost
+if TYPE_CHECKING:
+    import requests
+
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+
+# Attempts after the first one, only for rate limits, server errors and connection failures
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '2'))
+UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', '0.5'))
+UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', '8'))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '5'))
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', '10'))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_session: Optional['requests.Session'] = None
+_session_lock = threading.Lock()
+
+class DeadlineExceeded(Exception):
+    """Request budget ran out before the provider answered"""
+
+def get_session() -> 'requests.Session':
+    """Keep-alive session reused by warm invocations, proxied when PROXY_URL is set"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=UPSTREAM_POOL_SIZE, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                
+                proxy_url = os.getenv('PROXY_URL')
+                if proxy_url:
+                    session.proxies = {'http': proxy_url, 'https': proxy_url}
+                    if INFO:
+                        print("[INFO] Using proxy for OpenAI requests")
+                _session = session
+    return _session
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Seconds before the next attempt, Retry-After wins over full-jitter backoff"""
+    if retry_after:
+        try:
+            return min(UPSTREAM_BACKOFF_MAX, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt))
+
+def openai_post(path: str, payload: Dict[str, Any], deadline: float, stream: bool = False) -> 'requests.Response':
+    """
+    POST to the OpenAI API with retries inside a deadline
+    Args: path - endpoint below OPENAI_BASE_URL, e.g. /embeddings
+          payload - JSON body
+          deadline - seconds the whole call may take, retries included
+          stream - keep the body open for incremental reading
+    Returns: last response, which may still be an error status
+    """
+    import requests
+    
+    session = get_session()
+    headers = {
+        "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}",
+        "Content-Type": "application/json"
+    }
+    expires = time.monotonic() + deadline
+    
+    attempt = 0
+    while True:
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"OpenAI request to {path} exceeded {deadline}s")
+        
+        try:
+            response = session.post(
+                f"{OPENAI_BASE_URL}{path}",
+                headers=headers,
+                json=payload,
+                timeout=(min(UPSTREAM_CONNECT_TIMEOUT, remaining), remaining),
+                stream=stream
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= UPSTREAM_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt)
+            if time.monotonic() + delay >= expires:
+                raise
+            if INFO:
+                print(f"[INFO] OpenAI request to {path} failed ({e}), retrying in {delay:.2f}s")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt >= UPSTREAM_MAX_RETRIES:
+                return response
+            delay = backoff_delay(attempt, response.headers.get('Retry-After'))
+            if time.monotonic() + delay >= expires:
+                return response
+            if INFO:
+                print(f"[INFO] OpenAI returned {response.status_code} for {path}, retrying in {delay:.2f}s")
+            response.close()
+        
+        time.sleep(delay)
+        attempt += 1
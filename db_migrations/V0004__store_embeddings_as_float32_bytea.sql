@@ -0,0 +1,8 @@
+-- Store embeddings as packed little-endian float32 (4 bytes per dimension)
+-- instead of JSON text. The legacy JSON column is kept until the backfill
+-- (backend/documents/backfill_embeddings.py) has converted every row.
+ALTER TABLE documents 
+RENAME COLUMN embedding TO embedding_json;
+
+ALTER TABLE documents 
+ADD COLUMN IF NOT EXISTS embedding BYTEA;
@@ -0,0 +1,7 @@
+-- Per-user library version, bumped on every document upload or delete.
+-- Warm chat instances compare it against their cached vector index.
+CREATE TABLE IF NOT EXISTS library_versions (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
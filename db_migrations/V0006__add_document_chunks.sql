@@ -0,0 +1,14 @@
+-- Overlapping chunks of each document with their own embeddings,
+-- chat retrieval works on chunks instead of whole documents
+CREATE TABLE IF NOT EXISTS document_chunks (
+    id SERIAL PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    user_id INTEGER REFERENCES users(id),
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    embedding BYTEA,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (document_id, chunk_index)
+);
+
+CREATE INDEX IF NOT EXISTS idx_document_chunks_user_id ON document_chunks(user_id);
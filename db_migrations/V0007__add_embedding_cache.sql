@@ -0,0 +1,11 @@
+-- Persistent tier of the query embedding cache, shared by all chat instances.
+-- Key is sha256 of model name and normalized query text.
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    cache_key CHAR(64) PRIMARY KEY,
+    model VARCHAR(100) NOT NULL,
+    embedding BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_embedding_cache_expires_at ON embedding_cache(expires_at);
@@ -0,0 +1,14 @@
+-- Content hash lets uploads of identical text reuse existing embeddings
+ALTER TABLE documents 
+ADD COLUMN IF NOT EXISTS content_hash CHAR(64),
+ADD COLUMN IF NOT EXISTS embedding_model VARCHAR(100);
+
+UPDATE documents 
+SET content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex')
+WHERE content_hash IS NULL;
+
+UPDATE documents 
+SET embedding_model = 'text-embedding-3-small'
+WHERE embedding IS NOT NULL AND embedding_model IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents(content_hash, embedding_model);
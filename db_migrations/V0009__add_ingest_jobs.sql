@@ -0,0 +1,15 @@
+-- Queue of documents waiting for chunking and embeddings, consumed by
+-- backend/documents/worker.py with SELECT ... FOR UPDATE SKIP LOCKED
+CREATE TABLE IF NOT EXISTS ingest_jobs (
+    id SERIAL PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_pending ON ingest_jobs(next_attempt_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_ingest_jobs_document_id ON ingest_jobs(document_id);
@@ -0,0 +1,17 @@
+-- Per-user IVF index for approximate nearest-neighbour search over chunks.
+-- Centroids are packed float32 rows, every embedded chunk records its inverted
+-- list in document_chunks.ann_list (NULL until assigned, scanned exactly).
+CREATE TABLE IF NOT EXISTS vector_indexes (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    dim INTEGER NOT NULL,
+    nlist INTEGER NOT NULL,
+    nprobe INTEGER NOT NULL,
+    centroids BYTEA NOT NULL,
+    trained_size INTEGER NOT NULL,
+    recall REAL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS ann_list INTEGER;
+
+CREATE INDEX IF NOT EXISTS idx_document_chunks_user_ann_list ON document_chunks(user_id, ann_list);
@@ -0,0 +1,7 @@
+-- Precomputed list preview, so the library listing never reads full content.
+-- Must match make_preview in backend/documents/ingest.py.
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS preview TEXT;
+
+UPDATE documents
+SET preview = CASE WHEN length(content) > 200 THEN left(content, 200) || '...' ELSE content END
+WHERE preview IS NULL;
@@ -0,0 +1,7 @@
+-- Full-text index over chunk text for lexical and hybrid retrieval.
+-- 'simple' configuration: no stemming or stop words, works for any language
+-- and keeps identifiers and names as exact lexemes.
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_document_chunks_search_vector ON document_chunks USING GIN (search_vector);
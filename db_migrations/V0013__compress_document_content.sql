@@ -0,0 +1,15 @@
+-- Document text may be stored compressed: content_codec names the codec,
+-- the bytes go to content_compressed and content stays NULL. Rows with a
+-- NULL codec keep plain text in content. Must match backend/documents/compression.py,
+-- existing rows are converted by backend/documents/backfill_compression.py.
+ALTER TABLE documents ALTER COLUMN content DROP NOT NULL;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_compressed BYTEA;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_codec VARCHAR(16);
+
+-- Already compressed, so stored out of line without another pglz attempt
+ALTER TABLE documents ALTER COLUMN content_compressed SET STORAGE EXTERNAL;
+
+ALTER TABLE documents ADD CONSTRAINT documents_content_stored CHECK (
+    (content_codec IS NULL AND content IS NOT NULL)
+    OR (content_codec IS NOT NULL AND content_compressed IS NOT NULL)
+);
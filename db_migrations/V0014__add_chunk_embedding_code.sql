@@ -0,0 +1,6 @@
+-- Compact code of every chunk embedding, scored by chat search before the
+-- shortlist is re-ranked against the float32 vector in embedding.
+-- First byte is the kind (1 int8 with a float32 scale, 2 binary sign bits),
+-- see encode_code in backend/documents/vectors.py. NULL for chunks embedded
+-- before this column, chat encodes those from embedding when it loads them.
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_code BYTEA;
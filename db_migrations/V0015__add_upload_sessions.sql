@@ -0,0 +1,26 @@
+-- Resumable chunked uploads, see backend/documents/uploads.py. The document
+-- row is created at init with user_id NULL, so it stays out of listings and
+-- search until finalize assigns it; its chunks are written and queued for
+-- embedding part by part. Parts keep the raw text until finalize joins them
+-- into documents.content.
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id VARCHAR(32) PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    next_part INTEGER NOT NULL DEFAULT 0,
+    received_chars BIGINT NOT NULL DEFAULT 0,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    -- Text after the last complete chunk, split again with the next part
+    carry TEXT NOT NULL DEFAULT '',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_user_id ON upload_sessions(user_id);
+
+CREATE TABLE IF NOT EXISTS upload_parts (
+    upload_id VARCHAR(32) NOT NULL REFERENCES upload_sessions(id) ON DELETE CASCADE,
+    part_number INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (upload_id, part_number)
+);
@@ -0,0 +1,89 @@
+"""
+Recall@k and query cost of the IVF index against the exact scan
+
+Usage: python devtools/ann_recall.py --sizes 2000 10000 50000 --dim 1536
+Vectors are synthetic clusters of unit vectors, queries are held-out
+perturbations of them, as real questions sit near but not on stored chunks.
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'documents'))
+
+from ann import ANN_MAX_TRAINING_ROWS, assign_lists, list_count, probe_lists, train_centroids, tune_nprobe  # noqa: E402
+from vectors import EMBEDDING_DTYPE, top_k  # noqa: E402
+
+def synthetic_library(size: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    """Unit vectors around random topic directions"""
+    topics = rng.normal(size=(max(1, size // 50), dim))
+    matrix = topics[rng.integers(0, topics.shape[0], size)] + rng.normal(scale=0.8, size=(size, dim))
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix.astype(EMBEDDING_DTYPE)
+
+def measure(size: int, dim: int, queries: int, k: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    matrix = synthetic_library(size, dim, rng)
+    picks = matrix[rng.choice(size, queries, replace=False)]
+    query_matrix = picks + rng.normal(scale=0.5 / np.sqrt(dim), size=picks.shape).astype(EMBEDDING_DTYPE)
+    query_matrix /= np.linalg.norm(query_matrix, axis=1, keepdims=True)
+
+    started = time.perf_counter()
+    nlist = list_count(size)
+    sample = matrix[rng.choice(size, min(size, ANN_MAX_TRAINING_ROWS, nlist * 64), replace=False)]
+    centroids = train_centroids(sample, nlist, seed)
+    tuning = tune_nprobe(sample, centroids, seed)
+    assignments = assign_lists(centroids, matrix)
+    build_seconds = time.perf_counter() - started
+
+    # Lists are stored contiguously, as the chat instance caches them per list
+    order = np.argsort(assignments, kind='stable')
+    lists = {int(key): matrix[order[assignments[order] == key]] for key in np.unique(assignments)}
+    list_rows = {int(key): order[assignments[order] == key] for key in lists}
+
+    exact_seconds = 0.0
+    ivf_seconds = 0.0
+    found = 0
+    for query in query_matrix:
+        started = time.perf_counter()
+        exact = {row for row, _ in top_k(matrix, query, k)}
+        exact_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        hits = []
+        for key in probe_lists(centroids, query, tuning['nprobe']):
+            if key in lists:
+                hits.extend((score, int(list_rows[key][row])) for row, score in top_k(lists[key], query, k))
+        approximate = {row for _, row in sorted(hits, reverse=True)[:k]}
+        ivf_seconds += time.perf_counter() - started
+        found += len(exact & approximate)
+
+    return {
+        'size': size,
+        'lists': centroids.shape[0],
+        'nprobe': tuning['nprobe'],
+        'build_s': round(build_seconds, 2),
+        'recall': round(found / (queries * k), 3),
+        'exact_ms': round(exact_seconds / queries * 1000, 3),
+        'ivf_ms': round(ivf_seconds / queries * 1000, 3),
+        'probed': round(tuning['nprobe'] / centroids.shape[0], 3)
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure IVF recall@k against the exact scan')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 10000, 50000])
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-recall', type=float, default=0.0, help='exit with status 1 below this recall')
+    args = parser.parse_args()
+
+    worst = 1.0
+    for size in args.sizes:
+        report = measure(size, args.dim, args.queries, args.k, args.seed)
+        worst = min(worst, report['recall'])
+        print(' '.join(f"{key}={value}" for key, value in report.items()))
+    sys.exit(1 if worst < args.min_recall else 0)
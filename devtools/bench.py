@@ -0,0 +1,343 @@
+"""
+Offline end-to-end benchmark of the auth, documents and chat handlers
+
+Handlers are invoked in-process with synthetic events against a local
+Postgres with all db_migrations applied, and devtools/openai_stub.py is
+started in a thread in place of the OpenAI API. Request shapes come from
+the "benchmarks" key of each function's tests.json, the "tests" fixtures
+are replayed once as a smoke check. String values in a benchmark body may
+contain {n}, replaced by a running request number to defeat caches.
+Authorization headers carry "Bearer {token}", replaced by a session token
+minted for the bench user from SESSION_SECRET, so no signed token is
+committed.
+
+Usage: DATABASE_URL=... python devtools/bench.py --sizes 20 1000 10000 100000 --concurrency 1 4 16
+Reports p50/p95/p99 of every stage in milliseconds and throughput per
+scenario, library size and concurrency level.
+"""
+import argparse
+import contextlib
+import hashlib
+import importlib
+import io
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import parse_qsl, urlsplit
+import numpy as np
+import psycopg2
+import psycopg2.extras
+
+DEVTOOLS = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.join(DEVTOOLS, '..', 'backend')
+sys.path.insert(0, DEVTOOLS)
+
+import openai_stub  # noqa: E402
+
+FUNCTIONS = ('auth', 'documents', 'chat')
+SEED_BATCH_SIZE = 2000
+
+# Synthetic documents are drawn from this vocabulary, benchmark questions use it too
+VOCABULARY = (
+    "report revenue growth quarter forecast budget contract invoice payment customer "
+    "supplier delivery schedule project milestone risk audit policy compliance security "
+    "incident network server database backup migration release roadmap feature design "
+    "research experiment result analysis model training dataset metric latency cost"
+).split()
+
+class FunctionLoader:
+    """
+    Each function directory has its own index, db, vectors and so on, so only
+    one of them may own those module names at a time. Switching functions
+    parks the current modules and restores the target's, which keeps
+    connection pools and warm caches alive across phases.
+    """
+
+    def __init__(self):
+        self.parked = {name: {} for name in FUNCTIONS}
+        self.modules = {}
+        self.active = None
+
+    def local_names(self, name):
+        directory = os.path.join(BACKEND, name)
+        return {entry[:-3] for entry in os.listdir(directory) if entry.endswith('.py')}
+
+    def activate(self, name):
+        if self.active == name:
+            return self.modules[name]
+        if self.active is not None:
+            for module_name in self.local_names(self.active):
+                module = sys.modules.pop(module_name, None)
+                if module is not None:
+                    self.parked[self.active][module_name] = module
+            sys.path.remove(os.path.join(BACKEND, self.active))
+
+        sys.path.insert(0, os.path.join(BACKEND, name))
+        sys.modules.update(self.parked[name])
+        self.parked[name] = {}
+        if name not in self.modules:
+            self.modules[name] = importlib.import_module('index')
+        self.active = name
+        return self.modules[name]
+
+def render(value, n):
+    """Substitute {n} in every string of a benchmark body"""
+    if isinstance(value, str):
+        return value.replace('{n}', str(n))
+    if isinstance(value, list):
+        return [render(item, n) for item in value]
+    if isinstance(value, dict):
+        return {key: render(item, n) for key, item in value.items()}
+    return value
+
+def make_event(case, token, n):
+    """HTTP event for one fixture or benchmark case, authorized as the bench user"""
+    url = urlsplit(case.get('path', '/'))
+    headers = dict(case.get('headers', {}))
+    if token and 'Authorization' in headers:
+        headers['Authorization'] = headers['Authorization'].replace('{token}', token)
+    body = case.get('body')
+    return {
+        'httpMethod': case.get('method', 'GET'),
+        'headers': headers,
+        'body': json.dumps(render(body, n)) if body is not None else None,
+        'queryStringParameters': dict(parse_qsl(url.query)) or None
+    }
+
+def invoke(module, event):
+    """
+    Call the handler and split its latency into stages
+    Returns: (status code, stages in milliseconds)
+    """
+    started = time.perf_counter()
+    call = getattr(module, 'stream_handler', module.handler)
+    response = call(event, None)
+    body = response['body']
+    stages = {}
+
+    if not isinstance(body, str):
+        frames = []
+        for frame in body:
+            if 'first_frame_ms' not in stages:
+                stages['first_frame_ms'] = (time.perf_counter() - started) * 1000
+            frames.append(frame)
+        body = ''.join(frames)
+    stages['total_ms'] = (time.perf_counter() - started) * 1000
+
+    # Spans of the Server-Timing header, streamed completion time is not part of it
+    for entry in response.get('headers', {}).get('Server-Timing', '').split(','):
+        name, _, duration = entry.strip().partition(';dur=')
+        if duration and name != 'total':
+            stages[f"{name}_span_ms"] = float(duration)
+
+    # Chat reports its retrieval stages in the response metadata
+    if body.startswith('{'):
+        timings = json.loads(body).get('timings')
+        if isinstance(timings, dict):
+            stages.update({key: value for key, value in timings.items() if key.endswith('_ms')})
+    return response['statusCode'], stages
+
+def percentiles(samples):
+    values = np.asarray(samples, dtype=np.float64)
+    return {f"p{q}": round(float(np.percentile(values, q)), 1) for q in (50, 95, 99)}
+
+def run_case(module, case, token, counter, iterations, concurrency):
+    """Run iterations of one case across concurrent workers"""
+    stages = {}
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        status, timings = invoke(module, make_event(case, token, next(counter)))
+        with lock:
+            if status >= 400:
+                errors += 1
+            for key, value in timings.items():
+                stages.setdefault(key, []).append(value)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(iterations)))
+    wall = time.perf_counter() - started
+    return {
+        'requests': iterations,
+        'errors': errors,
+        'throughput': round(iterations / wall, 1),
+        'stages': {key: percentiles(values) for key, values in stages.items()}
+    }
+
+def load_cases(name, key):
+    with open(os.path.join(BACKEND, name, 'tests.json')) as f:
+        return json.load(f).get(key, [])
+
+def synthetic_vectors(size, dim, rng):
+    """Unit vectors around random topic directions"""
+    topics = rng.normal(size=(max(1, size // 50), dim))
+    matrix = topics[rng.integers(0, topics.shape[0], size)] + rng.normal(scale=0.8, size=(size, dim))
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix.astype(np.float32)
+
+def create_user(cursor, username):
+    cursor.execute("""
+        INSERT INTO users (username, password_hash, created_at) VALUES (%s, %s, %s) RETURNING id
+    """, (username, 'bench', datetime.now()))
+    return cursor.fetchone()[0]
+
+def seed_library(size, dim, seed):
+    """
+    Insert a user with size one-chunk documents straight into the database,
+    then build the IVF index and bump the library version like an upload would
+    Returns: user id
+    """
+    rng = np.random.default_rng(seed)
+    words = np.asarray(VOCABULARY)
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        user_id = create_user(cursor, f"bench-{size}-{time.time_ns()}")
+        created = datetime.now() - timedelta(days=1)
+
+        for start in range(0, size, SEED_BATCH_SIZE):
+            count = min(SEED_BATCH_SIZE, size - start)
+            vectors = synthetic_vectors(count, dim, rng)
+            contents = [' '.join(rng.choice(words, 120)) + f" document {start + i}" for i in range(count)]
+            cursor.execute("""
+                SELECT nextval(pg_get_serial_sequence('documents', 'id')) FROM generate_series(1, %s)
+            """, (count,))
+            ids = [row[0] for row in cursor.fetchall()]
+
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO documents (id, name, content, preview, file_type, content_hash,
+                                       embedding_model, embedding, created_at, user_id)
+                VALUES %s
+            """, [
+                (doc_id, f"doc-{start + i}.txt", content, content[:200] + '...', 'text/plain',
+                 hashlib.sha256(content.encode('utf-8')).hexdigest(), 'text-embedding-3-small',
+                 psycopg2.Binary(vector.tobytes()), created + timedelta(microseconds=start + i), user_id)
+                for i, (doc_id, content, vector) in enumerate(zip(ids, contents, vectors))
+            ], page_size=count)
+            encode_code = importlib.import_module('vectors').encode_code
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO document_chunks (document_id, user_id, chunk_index, content, embedding, embedding_code)
+                VALUES %s
+            """, [
+                (doc_id, user_id, 0, content, psycopg2.Binary(vector.tobytes()), encode_code(vector))
+                for doc_id, content, vector in zip(ids, contents, vectors)
+            ], page_size=count)
+            conn.commit()
+
+        ann = importlib.import_module('ann')
+        ann.maintain_index(cursor, user_id)
+        ann.bump_library_version(cursor, user_id)
+        conn.commit()
+        cursor.close()
+        return user_id
+    finally:
+        conn.close()
+
+def start_stub(args):
+    """OpenAI stand-in on an ephemeral port, returns its base URL"""
+    settings = openai_stub.parse_args([
+        '--port', '0',
+        '--dimensions', str(args.dim),
+        '--embedding-latency', str(args.embedding_latency),
+        '--first-token-latency', str(args.first_token_latency),
+        '--token-delay', str(args.token_delay)
+    ])
+    server = openai_stub.serve(settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def smoke_check(loader, token, counter, out):
+    """Replay the tests.json fixtures once, report unexpected statuses"""
+    # Auth fixtures register a fixed username, a fresh suffix keeps reruns at 201
+    suffix = f"-{time.time_ns()}"
+    for name in FUNCTIONS:
+        module = loader.activate(name)
+        for case in load_cases(name, 'tests'):
+            fixture = case
+            if 'username' in case.get('body', {}):
+                fixture = {**case, 'body': {**case['body'], 'username': case['body']['username'] + suffix}}
+            status, _ = invoke(module, make_event(fixture, token, next(counter)))
+            if status != case.get('expectedStatus'):
+                print(f"[ERROR] Fixture {name}: {case['name']} returned {status}, "
+                      f"expected {case.get('expectedStatus')}", file=out)
+
+def report(out, results, **labels):
+    for stage, values in results['stages'].items():
+        fields = {**labels, 'stage': stage, **values}
+        print(' '.join(f"{key}={value}" for key, value in fields.items()), file=out)
+    fields = {**labels, 'requests': results['requests'], 'errors': results['errors'], 'rps': results['throughput']}
+    print(' '.join(f"{key}={value}" for key, value in fields.items()), file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the functions end to end against local Postgres and the OpenAI stub')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 1000, 10000])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--iterations', type=int, default=50, help='requests per scenario and concurrency level')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--embedding-latency', type=float, default=0.05)
+    parser.add_argument('--first-token-latency', type=float, default=0.3)
+    parser.add_argument('--token-delay', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write results as JSON to this file')
+    parser.add_argument('--verbose', action='store_true', help='keep the handlers\' own log lines')
+    args = parser.parse_args(argv)
+
+    if not os.getenv('DATABASE_URL'):
+        parser.error('DATABASE_URL must point at a local Postgres with db_migrations applied')
+    os.environ['OPENAI_BASE_URL'] = start_stub(args)
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-bench')
+    os.environ.setdefault('SESSION_SECRET', 'bench-secret')
+    # Synthetic libraries go past the per-account limit, uploads on top of them must still pass
+    os.environ.setdefault('MAX_DOCUMENTS_PER_USER', str(10 * max(args.sizes) + 100000))
+
+    out = sys.stdout
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    loader = FunctionLoader()
+    counter = itertools.count()
+    rows = []
+
+    def record(results, **labels):
+        report(out, results, **labels)
+        rows.append({**labels, **results})
+
+    with quiet:
+        auth = loader.activate('auth')
+        for case in load_cases('auth', 'benchmarks'):
+            # Login scenarios need their user registered first, a 409 on reruns is fine
+            if case.get('body', {}).get('action') == 'login':
+                invoke(auth, make_event({**case, 'body': {**case['body'], 'action': 'register'}}, None, 0))
+            for level in args.concurrency:
+                record(run_case(auth, case, None, counter, args.iterations, level),
+                       function='auth', scenario=case['name'], concurrency=level)
+
+        for position, size in enumerate(args.sizes):
+            loader.activate('documents')
+            started = time.perf_counter()
+            user_id = seed_library(size, args.dim, args.seed + size)
+            print(f"size={size} seeded_s={round(time.perf_counter() - started, 1)}", file=out)
+            token = importlib.import_module('sessions').issue_token(user_id)
+            if position == 0:
+                smoke_check(loader, token, counter, out)
+
+            # Chat runs first, document uploads would bump the library version under it
+            for name in ('chat', 'documents'):
+                module = loader.activate(name)
+                for case in load_cases(name, 'benchmarks'):
+                    for level in args.concurrency:
+                        record(run_case(module, case, token, counter, args.iterations, level),
+                               function=name, scenario=case['name'], size=size, concurrency=level)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+if __name__ == '__main__':
+    main()
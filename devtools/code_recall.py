@@ -0,0 +1,115 @@
+"""
+Recall@k and memory of reduced dimensions and compact codes against full float32 vectors
+
+Usage: python devtools/code_recall.py --size 20000 --dims 1536 512 256 --codes none int8 binary
+       python devtools/code_recall.py --user 42 --dims 1536 512   (vectors of a stored library, DATABASE_URL)
+
+Truth is the exact top-k over the full vectors. Reduced dimensions are
+simulated by truncating and renormalizing, which is how text-embedding-3
+shortens vectors for its dimensions parameter. Each row reports recall of
+scoring the codes alone and after the re-rank of RERANK_FACTOR * k
+candidates against float32 vectors of that dimension, as chat search does.
+Synthetic vectors spread information evenly over dimensions, so their
+truncated rows are a pessimistic bound, a real library gives the figures
+to go by.
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'documents'))
+
+from vectors import EMBEDDING_DTYPE, code_size, encode_code, score_codes, stack_codes, stack_embeddings, top_k, top_scores  # noqa: E402
+
+def synthetic_library(size: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    """Unit vectors around random topic directions"""
+    topics = rng.normal(size=(max(1, size // 50), dim))
+    matrix = topics[rng.integers(0, topics.shape[0], size)] + rng.normal(scale=0.8, size=(size, dim))
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix.astype(EMBEDDING_DTYPE)
+
+def stored_library(user_id: int) -> np.ndarray:
+    """Chunk vectors of one user, the most common dimension only"""
+    import psycopg2
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT embedding FROM document_chunks WHERE user_id = %s AND embedding IS NOT NULL
+        """, (user_id,))
+        blobs = [bytes(row[0]) for row in cursor.fetchall()]
+    finally:
+        conn.close()
+    if not blobs:
+        raise SystemExit(f"User {user_id} has no embedded chunks")
+    dim = int(np.argmax(np.bincount([len(blob) for blob in blobs]))) // EMBEDDING_DTYPE.itemsize
+    return stack_embeddings(blobs, dim)[0]
+
+def truncate(matrix: np.ndarray, dim: int) -> np.ndarray:
+    reduced = matrix[:, :dim].copy()
+    reduced /= np.maximum(np.linalg.norm(reduced, axis=1, keepdims=True), 1e-12)
+    return reduced
+
+def measure(matrix: np.ndarray, queries: np.ndarray, dim: int, kind: str, k: int, factor: int) -> dict:
+    truth = [{row for row, _ in top_k(matrix, query, k)} for query in queries]
+    reduced = truncate(matrix, dim)
+    reduced_queries = truncate(queries, dim)
+
+    blobs = [encode_code(vector, kind) or vector.tobytes() for vector in reduced]
+    codes, _ = stack_codes(blobs, kind, dim)
+
+    coded_found = 0
+    reranked_found = 0
+    seconds = 0.0
+    for query, expected in zip(reduced_queries, truth):
+        started = time.perf_counter()
+        candidates = [row for row, _ in top_scores(score_codes(codes, query), k * factor)]
+        exact = reduced[candidates] @ query
+        reranked = {candidates[position] for position in np.argsort(-exact, kind='stable')[:k]}
+        seconds += time.perf_counter() - started
+        coded_found += len(expected & set(candidates[:k]))
+        reranked_found += len(expected & reranked)
+
+    total = len(queries) * k
+    return {
+        'dim': dim,
+        'code': kind,
+        'bytes_per_vector': code_size(kind, dim),
+        'compression': round(code_size('none', matrix.shape[1]) / code_size(kind, dim), 1),
+        'recall_codes': round(coded_found / total, 3),
+        'recall_reranked': round(reranked_found / total, 3),
+        'query_ms': round(seconds / len(queries) * 1000, 3)
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure recall@k of reduced dimensions and compact codes')
+    parser.add_argument('--size', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=1536, help='full dimension of synthetic vectors')
+    parser.add_argument('--user', type=int, help='measure the stored chunks of this user instead')
+    parser.add_argument('--dims', type=int, nargs='+', default=[1536, 512, 256])
+    parser.add_argument('--codes', nargs='+', default=['none', 'int8', 'binary'], choices=['none', 'int8', 'binary'])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=8)
+    parser.add_argument('--rerank-factor', type=int, default=int(os.getenv('RERANK_FACTOR', '4')))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-recall', type=float, default=0.0, help='exit with status 1 when a re-ranked recall is below this')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    matrix = stored_library(args.user) if args.user is not None else synthetic_library(args.size, args.dim, rng)
+    picks = matrix[rng.choice(matrix.shape[0], min(args.queries, matrix.shape[0]), replace=False)]
+    queries = picks + rng.normal(scale=0.5 / np.sqrt(matrix.shape[1]), size=picks.shape).astype(EMBEDDING_DTYPE)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    worst = 1.0
+    for dim in args.dims:
+        if dim > matrix.shape[1]:
+            continue
+        for kind in args.codes:
+            report = measure(matrix, queries, dim, kind, args.k, args.rerank_factor)
+            worst = min(worst, report['recall_reranked'])
+            print(' '.join(f"{key}={value}" for key, value in report.items()))
+    sys.exit(1 if worst < args.min_recall else 0)
@@ -0,0 +1,126 @@
+"""
+Local stand-in for the OpenAI embeddings and chat completions endpoints
+
+Usage: python devtools/openai_stub.py --port 8089 --token-delay 0.02
+Then point the functions at it with OPENAI_BASE_URL=http://127.0.0.1:8089/v1
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = (
+    "This is a stubbed answer streamed token by token so time to first token "
+    "and total generation time can be measured without the real API."
+)
+
+def fake_embedding(text: str, dimensions: int) -> list:
+    """Deterministic pseudo-random vector seeded by the text"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    rng = random.Random(seed)
+    return [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = argparse.Namespace()
+
+    def log_message(self, format, *args):
+        if self.settings.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status: int, data: dict) -> None:
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.settings.error_rate and random.random() < self.settings.error_rate:
+            self.send_json(503, {'error': {'message': 'stub overloaded'}})
+            return
+
+        if self.path.endswith('/embeddings'):
+            self.embeddings(body)
+        elif self.path.endswith('/chat/completions'):
+            self.completions(body)
+        else:
+            self.send_json(404, {'error': {'message': f'unknown path {self.path}'}})
+
+    def embeddings(self, body: dict) -> None:
+        inputs = body.get('input', '')
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimensions = body.get('dimensions') or self.settings.dimensions
+        time.sleep(self.settings.embedding_latency)
+        self.send_json(200, {
+            'object': 'list',
+            'model': body.get('model'),
+            'data': [
+                {'object': 'embedding', 'index': i, 'embedding': fake_embedding(text, dimensions)}
+                for i, text in enumerate(inputs)
+            ]
+        })
+
+    def completions(self, body: dict) -> None:
+        tokens = [word + ' ' for word in ANSWER.split(' ')]
+        tokens[-1] = tokens[-1].rstrip()
+        time.sleep(self.settings.first_token_latency)
+
+        if not body.get('stream'):
+            time.sleep(self.settings.token_delay * len(tokens))
+            self.send_json(200, {
+                'object': 'chat.completion',
+                'model': body.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)}, 'finish_reason': 'stop'}]
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.settings.token_delay)
+            chunk = {
+                'object': 'chat.completion.chunk',
+                'model': body.get('model'),
+                'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]
+            }
+            self.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--dimensions', type=int, default=1536)
+    parser.add_argument('--embedding-latency', type=float, default=0.05, help='seconds per embeddings request')
+    parser.add_argument('--first-token-latency', type=float, default=0.3, help='seconds before the first token')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='seconds between tokens')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+def serve(settings: argparse.Namespace) -> ThreadingHTTPServer:
+    """Create the stub server, callers run serve_forever (e.g. in a thread)"""
+    StubHandler.settings = settings
+    return ThreadingHTTPServer((settings.host, settings.port), StubHandler)
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = serve(args)
+    print(f"[INFO] OpenAI stub listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
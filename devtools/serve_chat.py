@@ -0,0 +1,63 @@
+"""
+Serve the chat function locally with real incremental SSE delivery
+
+The deployed function returns its body in one piece, this server calls
+stream_handler and writes every frame as soon as it is produced.
+
+Usage: DATABASE_URL=... OPENAI_BASE_URL=http://127.0.0.1:8089/v1 python devtools/serve_chat.py
+"""
+import argparse
+import os
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'chat'))
+
+import index  # noqa: E402
+
+class ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def handle_event(self, method: str) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        event = {
+            'httpMethod': method,
+            'headers': dict(self.headers.items()),
+            'body': self.rfile.read(length).decode('utf-8') if length else None,
+            'queryStringParameters': None
+        }
+        response = index.stream_handler(event, None)
+        body = response['body']
+
+        self.send_response(response['statusCode'])
+        for name, value in response.get('headers', {}).items():
+            self.send_header(name, value)
+
+        if isinstance(body, str):
+            payload = body.encode('utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for frame in body:
+            data = frame.encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        self.handle_event('POST')
+
+    def do_OPTIONS(self):
+        self.handle_event('OPTIONS')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the chat function with streaming responses')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args()
+    print(f"[INFO] Chat function listening on http://{args.host}:{args.port}")
+    ThreadingHTTPServer((args.host, args.port), ChatHandler).serve_forever()
@@ -0,0 +1,99 @@
+"""
+Cold-start import profile of each function, with a budget check
+
+Every function's index module is imported in a fresh interpreter under
+-X importtime, the way a cold instance loads it. The report shows the
+median import time of index and the packages that cost the most in it.
+The exit status is 1 when a function goes over its budget, which is
+"startupBudgetMs" in its tests.json unless --budget-ms overrides it.
+
+Usage: python devtools/startup_profile.py --functions auth chat documents --repeat 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+FUNCTIONS = ('auth', 'chat', 'documents')
+
+def profile_import(name: str) -> dict:
+    """
+    Import index of one function in a new interpreter
+    Returns: total import milliseconds of index and self milliseconds per module
+    """
+    directory = os.path.join(BACKEND, name)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import index'],
+        cwd=directory, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {name} failed:\n{result.stderr}")
+
+    # Lines look like "import time:  self [us] | cumulative | <indent>module",
+    # only modules imported below index count, not the interpreter's own startup
+    total = None
+    modules = {}
+    pending = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        module_name = module.strip()
+        depth = (len(module) - len(module.lstrip()) - 1) // 2
+        if depth == 0 and module_name != 'index':
+            pending = {}
+            continue
+        pending[module_name] = int(self_us) / 1000
+        if module_name == 'index' and depth == 0:
+            total = int(cumulative_us) / 1000
+            modules = pending
+    return {'total_ms': total, 'modules': modules}
+
+def package_costs(modules: dict) -> dict:
+    """Self time summed per top-level package, local modules keep their own name"""
+    costs = defaultdict(float)
+    for module, milliseconds in modules.items():
+        costs[module.split('.')[0]] += milliseconds
+    return dict(costs)
+
+def read_budget(name: str):
+    with open(os.path.join(BACKEND, name, 'tests.json')) as f:
+        return json.load(f).get('startupBudgetMs')
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Profile cold-start imports of the functions')
+    parser.add_argument('--functions', nargs='+', default=list(FUNCTIONS), choices=FUNCTIONS)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per function, the median counts')
+    parser.add_argument('--top', type=int, default=8, help='packages listed per function')
+    parser.add_argument('--budget-ms', type=float, help='budget for every function instead of tests.json')
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    for name in args.functions:
+        runs = [profile_import(name) for _ in range(args.repeat)]
+        total = statistics.median(run['total_ms'] for run in runs)
+        budget = args.budget_ms if args.budget_ms is not None else read_budget(name)
+
+        status = 'ok'
+        if budget is not None and total > budget:
+            status = 'OVER'
+            over_budget.append(name)
+        print(f"function={name} import_ms={total:.1f} budget_ms={budget} status={status}")
+
+        # Packages of the median run, slowest first
+        median_run = min(runs, key=lambda run: abs(run['total_ms'] - total))
+        costs = sorted(package_costs(median_run['modules']).items(), key=lambda item: item[1], reverse=True)
+        for package, milliseconds in costs[:args.top]:
+            print(f"  {package:<24} {milliseconds:8.1f} ms")
+
+    if over_budget:
+        print(f"[ERROR] Over startup budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
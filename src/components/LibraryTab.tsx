@@ -6,15 +6,21 @@ import { Document } from '@/types';
 interface LibraryTabProps {
   documents: Document[];
   isUploadingFile: boolean;
+  hasMoreDocuments: boolean;
+  isLoadingMore: boolean;
   onFileUpload: (event: React.ChangeEvent<HTMLInputElement>) => void;
   onDeleteDocument: (id: string) => void;
+  onLoadMore: () => void;
 }
 
 export function LibraryTab({
   documents,
   isUploadingFile,
+  hasMoreDocuments,
+  isLoadingMore,
   onFileUpload,
-  onDeleteDocument
+  onDeleteDocument,
+  onLoadMore
 }: LibraryTabProps) {
   return (
     <div className="flex flex-col lg:grid lg:grid-cols-3 gap-4 lg:gap-6">
@@ -97,6 +103,26 @@ export function LibraryTab({
                   </div>
                 ))
               )}
+              {hasMoreDocuments && (
+                <Button
+                  variant="outline"
+                  className="flex items-center gap-2 w-full text-sm"
+                  onClick={onLoadMore}
+                  disabled={isLoadingMore}
+                >
+                  {isLoadingMore ? (
+                    <>
+                      <Icon name="Loader2" size={14} className="animate-spin-slow" />
+                      <span>Loading...</span>
+                    </>
+                  ) : (
+                    <>
+                      <Icon name="ChevronDown" size={14} />
+                      <span>Load more</span>
+                    </>
+                  )}
+                </Button>
+              )}
             </div>
           </CardContent>
         </Card>
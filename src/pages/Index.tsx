@@ -11,6 +11,11 @@ import FileUploadPreview from '@/components/FileUploadPreview';
 import { Message, Document } from '@/types';
 import { useToast } from '@/hooks/use-toast';
 
+// Files longer than this many characters are uploaded in parts (backend/documents/uploads.py)
+const UPLOAD_PART_SIZE = 512 * 1024;
+// Library documents fetched per page, more are loaded on request
+const LIBRARY_PAGE_SIZE = 50;
+
 interface IndexProps {
   auth: {
     userId: number;
@@ -33,6 +38,8 @@ function Index({ auth, onLogin, onLogout }: IndexProps) {
   ]);
   
   const [documents, setDocuments] = useState<Document[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [showLoginModal, setShowLoginModal] = useState(false);
   const [showVideoModal, setShowVideoModal] = useState(false);
   const [showFilePreview, setShowFilePreview] = useState(false);
@@ -45,31 +52,66 @@ function Index({ auth, onLogin, onLogout }: IndexProps) {
   const scrollAreaRef = useRef<HTMLDivElement>(null);
   const messagesEndRef = useRef<HTMLDivElement>(null);
 
-  // Load documents from database on component mount
-  const loadDocuments = async () => {
-    if (!auth) return;
-    
+  // One page of the library listing, null when the request failed
+  const fetchDocumentsPage = async (cursor: string | null) => {
+    if (!auth) return null;
+
+    const url = `https://functions.poehali.dev/390dcbc7-61d3-4aa3-a4e6-c4276be353cd?limit=${LIBRARY_PAGE_SIZE}`
+      + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : '');
+    const response = await fetch(url, {
+      method: 'GET',
+      headers: {
+        'Authorization': `Bearer ${auth.token}`
+      }
+    });
 
+    if (response.status === 401) {
+      // Session expired or issued before signed tokens, sign in again
+      onLogout();
+      return null;
+    }
+    if (!response.ok) return null;
+    const data = await response.json();
+    return {
+      documents: data.documents.map((doc: any) => ({
+        id: doc.id.toString(),
+        name: doc.name,
+        content: doc.content,
+        uploadDate: new Date(doc.created_at)
+      })) as Document[],
+      nextCursor: data.next_cursor as string | null
+    };
+  };
+
+  // Load the first page of documents on component mount
+  const loadDocuments = async () => {
     try {
-      const response = await fetch('https://functions.poehali.dev/390dcbc7-61d3-4aa3-a4e6-c4276be353cd', {
-        method: 'GET',
-        headers: {
-          'X-User-Id': auth.userId.toString()
-        }
-      });
+      const page = await fetchDocumentsPage(null);
+      if (!page) return;
+      setDocuments(page.documents);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error loading documents:', error);
+    }
+  };
 
-      if (response.ok) {
-        const data = await response.json();
-        const formattedDocs = data.documents.map((doc: any) => ({
-          id: doc.id.toString(),
-          name: doc.name,
-          content: doc.content,
-          uploadDate: new Date(doc.created_at)
-        }));
-        setDocuments(formattedDocs);
-      }
+  const loadMoreDocuments = async () => {
+    if (!nextCursor || isLoadingMore) return;
+
+    setIsLoadingMore(true);
+    try {
+      const page = await fetchDocumentsPage(nextCursor);
+      if (!page) return;
+      // Skip documents already shown, e.g. uploaded in this session
+      setDocuments(prev => [
+        ...prev,
+        ...page.documents.filter(doc => !prev.some(existing => existing.id === doc.id))
+      ]);
+      setNextCursor(page.nextCursor);
     } catch (error) {
       console.error('Error loading documents:', error);
+    } finally {
+      setIsLoadingMore(false);
     }
   };
 
@@ -118,7 +160,7 @@ function Index({ auth, onLogin, onLogout }: IndexProps) {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
-          'X-User-Id': auth.userId.toString()
+          'Authorization': `Bearer ${auth.token}`
         },
         body: JSON.stringify({
           message: messageToSend,
@@ -192,22 +234,55 @@ function Index({ auth, onLogin, onLogout }: IndexProps) {
     }
   };
   
+  const postDocuments = (body: object) => fetch('https://functions.poehali.dev/390dcbc7-61d3-4aa3-a4e6-c4276be353cd', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'Authorization': `Bearer ${auth?.token || ''}`
+    },
+    body: JSON.stringify(body)
+  });
+
+  // init, one request per part, finalize; returns the response of the step that failed or of finalize
+  const uploadInParts = async (content: string, fileName: string) => {
+    const init = await postDocuments({ action: 'upload_init', name: fileName, file_type: 'text/plain' });
+    if (!init.ok) return init;
+    const { upload_id } = await init.json();
+
+    for (let part = 0, start = 0; start < content.length; part++) {
+      let end = Math.min(start + UPLOAD_PART_SIZE, content.length);
+      // Never cut between the two halves of a surrogate pair (emoji, rare CJK)
+      const last = content.charCodeAt(end - 1);
+      if (end < content.length && last >= 0xd800 && last <= 0xdbff) end--;
+      const body = {
+        action: 'upload_part',
+        upload_id,
+        part_number: part,
+        content: content.slice(start, end)
+      };
+      start = end;
+      // A resent part is acknowledged by the server, so one retry is safe
+      let response = await postDocuments(body).catch(() => null);
+      if (!response || response.status >= 500) {
+        response = await postDocuments(body);
+      }
+      if (!response.ok) return response;
+    }
+
+    return postDocuments({ action: 'upload_finalize', upload_id });
+  };
+  
   const uploadTextContent = async (content: string, fileName: string) => {
     if (!auth) return;
     
     try {
-      const response = await fetch('https://functions.poehali.dev/390dcbc7-61d3-4aa3-a4e6-c4276be353cd', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'X-User-Id': auth.userId.toString()
-        },
-        body: JSON.stringify({
-          name: fileName,
-          content: content,
-          file_type: 'text/plain'
-        })
-      });
+      const response = content.length > UPLOAD_PART_SIZE
+        ? await uploadInParts(content, fileName)
+        : await postDocuments({
+            name: fileName,
+            content: content,
+            file_type: 'text/plain'
+          });
 
       if (response.ok) {
         const data = await response.json();
@@ -255,7 +330,7 @@ function Index({ auth, onLogin, onLogout }: IndexProps) {
       const response = await fetch(`https://functions.poehali.dev/390dcbc7-61d3-4aa3-a4e6-c4276be353cd?id=${id}`, {
         method: 'DELETE',
         headers: {
-          'X-User-Id': auth?.userId?.toString() || ''
+          'Authorization': `Bearer ${auth?.token || ''}`
         }
       });
 
@@ -307,8 +382,11 @@ function Index({ auth, onLogin, onLogout }: IndexProps) {
             <LibraryTab
               documents={documents}
               isUploadingFile={isUploadingFile}
+              hasMoreDocuments={nextCursor !== null}
+              isLoadingMore={isLoadingMore}
               onFileUpload={handleFileUpload}
               onDeleteDocument={deleteDocument}
+              onLoadMore={loadMoreDocuments}
             />
           </TabsContent>
         </Tabs>